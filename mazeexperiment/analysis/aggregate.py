@@ -0,0 +1,193 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+
+import os, sys
+
+from .ingest import DATASET_FILE, MISSING_OFFSET, flatten, load_dataset
+
+# Reading times per word position around the critical word, by condition,
+# from the pair table of an ingested dataset. Every step is a grouped array
+# operation: rows are given one integer code per group, and sums, counts and
+# ranks within groups come from bincount and a single sort, so the cost grows
+# with the number of rows rather than the number of groups.
+#
+# Words are first averaged per participant, condition and position (and per
+# region), then the participant means are summarised per condition.
+
+AGGREGATE_FILE = u'maze_aggregate.npz'
+
+# Only correct responses within these bounds (ms) are kept
+MIN_RT = 100
+MAX_RT = 5000
+
+# Proportion cut from each end of a participant's cell for the trimmed mean
+TRIM = 0.1
+
+# Regions by offset from the critical word, first and last offset included
+SPILLOVER = 2
+REGIONS = (
+    ('precritical', -1, -1),
+    ('critical', 0, 0),
+    ('spillover', 1, SPILLOVER)
+)
+
+SESSION_TYPES = (u'participant',)
+
+def group_codes(*keys):
+    # One code per distinct combination of keys, and the keys of each code
+    codes = []
+    uniques = []
+    for key in keys:
+        unique, inverse = np.unique(key, return_inverse=True)
+        codes.append(inverse.reshape(-1))
+        uniques.append(unique)
+
+    if not len(keys[0]):
+        return np.zeros(0, dtype=np.intp), uniques
+
+    shape = [len(unique) for unique in uniques]
+    groups, inverse = np.unique(np.ravel_multi_index(codes, shape), return_inverse=True)
+    indices = np.unravel_index(groups, shape)
+
+    return inverse.reshape(-1), [unique[index] for unique, index in zip(uniques, indices)]
+
+def group_counts(inverse, groups):
+    return np.bincount(inverse, minlength=groups)
+
+def group_means(values, inverse, groups):
+    counts = group_counts(inverse, groups)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.bincount(inverse, weights=values, minlength=groups) / counts
+
+def group_sds(values, inverse, groups):
+    counts = group_counts(inverse, groups)
+    means = group_means(values, inverse, groups)
+    squares = np.bincount(inverse, weights=(values - means[inverse]) ** 2, minlength=groups)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(counts > 1, np.sqrt(squares / (counts - 1)), np.nan)
+
+def group_ranks(values, inverse, groups):
+    # Rank of every value within its group, smallest first
+    order = np.lexsort((values, inverse))
+    starts = np.concatenate(([0], np.cumsum(group_counts(inverse, groups))[:-1]))
+    ranks = np.empty(len(values), dtype=np.intp)
+    ranks[order] = np.arange(len(values)) - starts[inverse[order]]
+    return ranks
+
+def trimmed_means(values, inverse, groups, proportion=TRIM):
+    counts = group_counts(inverse, groups)
+    cut = np.floor(counts * proportion).astype(np.intp)
+    ranks = group_ranks(values, inverse, groups)
+    keep = (ranks >= cut[inverse]) & (ranks < (counts - cut)[inverse])
+    return group_means(values[keep], inverse[keep], groups)
+
+def select_pairs(pairs, session_types=SESSION_TYPES, min_rt=MIN_RT, max_rt=MAX_RT):
+    rt = pairs['resp.RT']
+    keep = (pairs['resp.acc'] == 1) & (rt >= min_rt) & (rt <= max_rt) \
+        & (pairs['critical_offset'] != MISSING_OFFSET) & (pairs['condition'] > 0)
+    if session_types is not None:
+        keep &= np.isin(pairs['session_type'], session_types)
+
+    return dict((column, values[keep]) for column, values in pairs.items())
+
+def region_codes(offsets, regions=REGIONS):
+    # Index into regions for every offset, -1 outside all regions
+    codes = np.full(len(offsets), -1, dtype=np.intp)
+    for i, (name, first, last) in enumerate(regions):
+        codes[(offsets >= first) & (offsets <= last)] = i
+    return codes
+
+def cell_table(rt, inverse, keys, names, trim=TRIM):
+    groups = len(keys[0])
+    table = dict(zip(names, keys))
+    table['n'] = group_counts(inverse, groups)
+    table['mean'] = group_means(rt, inverse, groups)
+    table['trimmed_mean'] = trimmed_means(rt, inverse, groups, trim)
+    return table
+
+def word_means(pairs, trim=TRIM):
+    # Per participant, condition and offset from the critical word
+    inverse, keys = group_codes(pairs['participant'], pairs['condition'], pairs['critical_offset'])
+    return cell_table(pairs['resp.RT'], inverse, keys, ('participant', 'condition', 'critical_offset'), trim)
+
+def region_means(pairs, regions=REGIONS, trim=TRIM):
+    # A region's reading time in a sentence is the mean over its words, then
+    # those are summarised per participant, condition and region
+    codes = region_codes(pairs['critical_offset'], regions)
+    inside = codes >= 0
+    participant = pairs['participant'][inside]
+    session = pairs['session'][inside]
+    sentence = pairs['sentence_number'][inside]
+    condition = pairs['condition'][inside]
+    codes = codes[inside]
+
+    inverse, keys = group_codes(session, sentence, codes)
+    groups = len(keys[0])
+    sentence_rt = group_means(pairs['resp.RT'][inside], inverse, groups)
+
+    # Every row of a sentence carries the same participant and condition
+    row = np.zeros(groups, dtype=np.intp)
+    row[inverse] = np.arange(len(inverse))
+
+    names = np.array([name for name, first, last in regions])
+    inverse, keys = group_codes(participant[row], condition[row], names[keys[2]])
+    return cell_table(sentence_rt, inverse, keys, ('participant', 'condition', 'region'), trim)
+
+def condition_summary(cells, by, value='mean'):
+    # Across participants: how many contributed, mean, SD and standard error
+    finite = np.isfinite(cells[value])
+    values = cells[value][finite]
+    inverse, keys = group_codes(*[cells[name][finite] for name in by])
+    groups = len(keys[0])
+
+    summary = dict(zip(by, keys))
+    summary['participants'] = group_counts(inverse, groups)
+    summary['mean'] = group_means(values, inverse, groups)
+    summary['sd'] = group_sds(values, inverse, groups)
+    with np.errstate(invalid='ignore'):
+        summary['se'] = summary['sd'] / np.sqrt(summary['participants'])
+    return summary
+
+def aggregate(pairs, regions=REGIONS, trim=TRIM, session_types=SESSION_TYPES, min_rt=MIN_RT, max_rt=MAX_RT):
+    pairs = select_pairs(pairs, session_types, min_rt, max_rt)
+    words = word_means(pairs, trim)
+    region_cells = region_means(pairs, regions, trim)
+
+    return {
+        'words': words,
+        'regions': region_cells,
+        'word_summary': condition_summary(words, ('condition', 'critical_offset')),
+        'word_summary_trimmed': condition_summary(words, ('condition', 'critical_offset'), 'trimmed_mean'),
+        'region_summary': condition_summary(region_cells, ('condition', 'region')),
+        'region_summary_trimmed': condition_summary(region_cells, ('condition', 'region'), 'trimmed_mean')
+    }
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    include_all = '--all' in argv
+    argv = [arg for arg in argv if arg != '--all']
+    if not argv:
+        print('usage: python -m mazeexperiment.analysis.aggregate [--all] DATASET_DIR [OUTPUT_FILE]')
+        return 1
+
+    dataset_dir = argv[0]
+    output_file = argv[1] if len(argv) > 1 else os.path.join(dataset_dir, AGGREGATE_FILE)
+    pairs = load_dataset(os.path.join(dataset_dir, DATASET_FILE))['pairs']
+
+    # --all keeps test and autorun sessions as well
+    tables = aggregate(pairs, session_types=None if include_all else SESSION_TYPES)
+    np.savez_compressed(output_file, **flatten(tables))
+
+    summary = tables['region_summary']
+    for condition, region, participants, mean, se in zip(
+            summary['condition'], summary['region'], summary['participants'], summary['mean'], summary['se']):
+        print('condition {} {:<12} n={:<4} {:8.1f} ms (SE {:.1f})'.format(
+            condition, region, participants, mean, se
+        ))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,350 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+
+import csv
+import io
+import json
+import os, sys
+
+# Collects the session files in participant_data into two tidy tables, one
+# row per answered word pair and one per sentence, with typed columns. Each
+# session is converted once into a compressed part under the output directory
+# and listed in a manifest; later runs only convert sessions that are new or
+# have changed, then concatenate the parts into one compressed dataset.
+#
+# A session is read from its CSV, or from its .stream.jsonl when the CSV is
+# missing (a session that crashed). Practice rows are left out.
+
+INGEST_VERSION = 2
+DATASET_FILE = u'maze_dataset.npz'
+MANIFEST_FILE = u'manifest.json'
+PARTS_DIR = u'sessions'
+
+CSV_EXTENSION = u'.csv'
+STREAM_EXTENSION = u'.stream.jsonl'
+
+# Stand-ins for missing values in integer columns; floats use NaN. Offsets
+# from the critical word can be negative, so they get their own
+MISSING_INT = -1
+MISSING_OFFSET = -32768
+MISSING_VALUES = {'critical_offset': MISSING_OFFSET}
+
+SESSION_TYPES = (
+    (u'AUTORUN-DEBUG-DATA-', u'autorun'),
+    (u'TESTFILE-', u'test')
+)
+
+PAIR_COLUMNS = [
+    ('sentence_number', 'i4'),
+    ('sentence_block.thisN', 'i4'),
+    ('sentence_trial.thisN', 'i4'),
+    ('condition', 'i1'),
+    ('critical_index', 'i2'),
+    ('critical_pair', 'i2'),
+    ('critical_offset', 'i2'),
+    ('critical_distractor', 'U'),
+    ('pair_correct', 'U'),
+    ('pair_distractor', 'U'),
+    ('target_pos', 'i1'),
+    ('resp', 'i1'),
+    ('resp.RT', 'f8'),
+    ('resp.acc', 'i1'),
+    ('pair.onset_scheduled', 'f8'),
+    ('pair.onset_actual', 'f8'),
+    ('pair.onset_slip', 'i4'),
+    ('prev.pos', 'i1'),
+    ('prev.resp', 'i1')
+]
+
+SENTENCE_COLUMNS = [
+    ('sentence_number', 'i4'),
+    ('sentence_block.thisN', 'i4'),
+    ('condition', 'i1'),
+    ('critical_index', 'i2'),
+    ('critical_pair', 'i2'),
+    ('critical_target', 'U'),
+    ('critical_distractor', 'U'),
+    ('full_sentence', 'U'),
+    ('frame_rate', 'f8'),
+    ('block.acc', 'i1'),
+    ('block.RT', 'f8'),
+    ('pretrial_fixation', 'f8'),
+    ('frames.dropped', 'i4'),
+    ('frames.jitter', 'f8')
+]
+
+# Per-phase frame timing columns, whichever phases a session recorded
+TIMING_SUFFIXES = (('.dropped', 'i4'), ('.intended', 'f8'), ('.actual', 'f8'))
+
+SESSION_COLUMNS = [
+    ('participant', 'i4'),
+    ('session', 'U'),
+    ('session_type', 'U')
+]
+
+def open_csv(path, mode='r'):
+    if sys.version_info[0] < 3:
+        return open(path, mode + 'b')
+    return io.open(path, mode, newline='', encoding='utf-8')
+
+def csv_rows(csv_file):
+    with open_csv(csv_file) as source:
+        for row in csv.DictReader(source):
+            if sys.version_info[0] < 3:
+                row = dict((name.decode('utf-8'), value.decode('utf-8')) for name, value in row.items())
+            yield row
+
+def stream_rows(stream_file):
+    # Session info is repeated into every row, as the CSV does
+    info = {}
+    with io.open(stream_file, 'r', encoding='utf-8') as stream:
+        for line in stream:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                continue
+
+            if 'info' in record:
+                info.update(record['info'])
+            elif 'row' in record:
+                row = dict(info)
+                row.update(record['row'])
+                yield row
+
+def session_type(stem):
+    for prefix, name in SESSION_TYPES:
+        if stem.startswith(prefix):
+            return name
+    return u'participant'
+
+def find_sessions(data_dir):
+    # Session stem -> the file to read it from
+    sessions = {}
+    for filename in sorted(os.listdir(data_dir)):
+        if filename.endswith(STREAM_EXTENSION):
+            stem = filename[:-len(STREAM_EXTENSION)]
+            sessions.setdefault(stem, filename)
+        elif filename.endswith(CSV_EXTENSION):
+            sessions[filename[:-len(CSV_EXTENSION)]] = filename
+
+    return sessions
+
+def _empty(value):
+    return value is None or value == u''
+
+def missing_value(name, kind):
+    if kind == 'U':
+        return u''
+    return np.nan if kind.startswith('f') else MISSING_VALUES.get(name, MISSING_INT)
+
+def convert_value(value, kind, missing=MISSING_INT):
+    if kind == 'U':
+        return u'' if _empty(value) else u'{}'.format(value)
+    if _empty(value):
+        return np.nan if kind.startswith('f') else missing
+    if kind.startswith('f'):
+        return float(value)
+    return int(float(value))
+
+def timing_columns(row):
+    columns = []
+    for name in row:
+        if name.startswith('frames.'):
+            continue
+        for suffix, kind in TIMING_SUFFIXES:
+            if name.endswith(suffix):
+                columns.append((name, kind))
+    return columns
+
+def build_table(rows, columns):
+    table = {}
+    for name, kind in columns:
+        missing = missing_value(name, kind)
+        values = [convert_value(row.get(name), kind, missing) for row in rows]
+        if kind == 'U':
+            table[name] = np.array(values, dtype=np.str_ if sys.version_info[0] >= 3 else np.unicode_)
+        else:
+            table[name] = np.array(values, dtype=kind).reshape(-1)
+    return table
+
+def fill_critical_positions(pairs):
+    # Sessions recorded before pairs carried their offset: the critical pair
+    # is the one whose distractor starts with the sentence's critical
+    # distractor (pairs marked * are joined onto the end of it)
+    missing = pairs['critical_offset'] == MISSING_OFFSET
+    if not missing.any():
+        return pairs
+
+    blocks = pairs['sentence_block.thisN']
+    positions = pairs['sentence_trial.thisN']
+    critical = np.char.startswith(pairs['pair_distractor'], pairs['critical_distractor']) \
+        & (pairs['critical_distractor'] != u'') & (blocks >= 0)
+
+    critical_pair = np.full(blocks.max() + 1, MISSING_INT, dtype=positions.dtype)
+    critical_pair[blocks[critical]] = positions[critical]
+    found = critical_pair[blocks]
+    fill = missing & (found != MISSING_INT)
+
+    pairs['critical_pair'][fill] = found[fill]
+    pairs['critical_offset'][fill] = positions[fill] - found[fill]
+    return pairs
+
+def read_session(path, stem):
+    rows = csv_rows(path) if path.endswith(CSV_EXTENSION) else stream_rows(path)
+
+    pairs = []
+    sentences = []
+    extra = []
+    participant = None
+    for row in rows:
+        if participant is None and not _empty(row.get('participant')):
+            participant = int(row['participant'])
+
+        # Practice rows never carry the main sentence loop
+        if _empty(row.get('sentence_block.thisN')):
+            continue
+        if not _empty(row.get('resp.RT')):
+            pairs.append(row)
+        elif not _empty(row.get('block.RT')):
+            sentences.append(row)
+            if not extra:
+                extra = timing_columns(row)
+
+    session = {
+        'participant': MISSING_INT if participant is None else participant,
+        'session': stem,
+        'session_type': session_type(stem)
+    }
+    tables = {
+        'pairs': fill_critical_positions(build_table(pairs, PAIR_COLUMNS)),
+        'sentences': build_table(sentences, SENTENCE_COLUMNS + extra)
+    }
+    for table in tables.values():
+        count = len(next(iter(table.values())))
+        for name, kind in SESSION_COLUMNS:
+            table[name] = build_table([session] * count, [(name, kind)])[name]
+
+    return tables
+
+def flatten(tables):
+    return dict(
+        (u'{}/{}'.format(table_name, column), values)
+        for table_name, table in tables.items() for column, values in table.items()
+    )
+
+def load_dataset(dataset_file):
+    tables = {}
+    with np.load(dataset_file) as dataset:
+        for key in dataset.files:
+            table_name, column = key.split('/', 1)
+            tables.setdefault(table_name, {})[column] = dataset[key]
+    return tables
+
+def concatenate(parts):
+    tables = {}
+    for part in parts:
+        for table_name, table in part.items():
+            tables.setdefault(table_name, []).append(table)
+
+    combined = {}
+    for table_name, pieces in tables.items():
+        # Sessions can differ in which timing phases they recorded
+        columns = []
+        for piece in pieces:
+            columns.extend(name for name in piece if name not in columns)
+
+        combined[table_name] = {}
+        for column in columns:
+            values = []
+            for piece in pieces:
+                if column in piece:
+                    values.append(piece[column])
+                else:
+                    count = len(next(iter(piece.values())))
+                    like = next(p[column] for p in pieces if column in p)
+                    values.append(np.full(count, missing_value(column, like.dtype.kind), dtype=like.dtype))
+            combined[table_name][column] = np.concatenate(values)
+
+    return combined
+
+def _write_json(path, contents):
+    temp_file = u'{}.{}.tmp'.format(path, os.getpid())
+    with io.open(temp_file, 'w', encoding='utf-8') as output:
+        text = json.dumps(contents, indent=2, sort_keys=True)
+        output.write(text.decode('utf-8') if isinstance(text, bytes) else text)
+    if os.path.exists(path):
+        os.remove(path)
+    os.rename(temp_file, path)
+
+def ingest(data_dir, output_dir):
+    parts_dir = os.path.join(output_dir, PARTS_DIR)
+    if not os.path.isdir(parts_dir):
+        os.makedirs(parts_dir)
+
+    manifest_file = os.path.join(output_dir, MANIFEST_FILE)
+    manifest = {'version': INGEST_VERSION, 'sessions': {}}
+    if os.path.exists(manifest_file):
+        with io.open(manifest_file, 'r', encoding='utf-8') as source:
+            previous = json.load(source)
+        if previous.get('version') == INGEST_VERSION:
+            manifest = previous
+
+    sessions = find_sessions(data_dir)
+    converted = []
+    for stem, filename in sorted(sessions.items()):
+        path = os.path.join(data_dir, filename)
+        stat = os.stat(path)
+        entry = {'source': filename, 'size': stat.st_size, 'mtime': stat.st_mtime}
+        part_file = os.path.join(parts_dir, stem + u'.npz')
+
+        known = manifest['sessions'].get(stem)
+        if known is not None and all(known.get(key) == value for key, value in entry.items()) \
+                and os.path.exists(part_file):
+            continue
+
+        tables = read_session(path, stem)
+        np.savez_compressed(part_file, **flatten(tables))
+        entry['pairs'] = len(tables['pairs']['session'])
+        entry['sentences'] = len(tables['sentences']['session'])
+        manifest['sessions'][stem] = entry
+        converted.append(stem)
+
+    removed = [stem for stem in manifest['sessions'] if stem not in sessions]
+    for stem in removed:
+        del manifest['sessions'][stem]
+        part_file = os.path.join(parts_dir, stem + u'.npz')
+        if os.path.exists(part_file):
+            os.remove(part_file)
+
+    dataset_file = os.path.join(output_dir, DATASET_FILE)
+    if converted or removed or not os.path.exists(dataset_file):
+        parts = [
+            load_dataset(os.path.join(parts_dir, stem + u'.npz'))
+            for stem in sorted(manifest['sessions'])
+        ]
+        temp_file = u'{}.{}.tmp.npz'.format(dataset_file[:-4], os.getpid())
+        np.savez_compressed(temp_file, **flatten(concatenate(parts)))
+        if os.path.exists(dataset_file):
+            os.remove(dataset_file)
+        os.rename(temp_file, dataset_file)
+
+    _write_json(manifest_file, manifest)
+    return dataset_file, converted
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        print('usage: python -m mazeexperiment.analysis.ingest DATA_DIR [OUTPUT_DIR]')
+        return 1
+
+    data_dir = argv[0]
+    output_dir = argv[1] if len(argv) > 1 else os.path.join(data_dir, u'dataset')
+    dataset_file, converted = ingest(data_dir, output_dir)
+    print('Ingested {} new sessions into {}'.format(len(converted), dataset_file))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
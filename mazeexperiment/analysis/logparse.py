@@ -0,0 +1,195 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+
+from multiprocessing import Pool
+import io
+import os, re, sys
+
+from .ingest import (CSV_EXTENSION, STREAM_EXTENSION, build_table, concatenate,
+                     flatten, read_session)
+
+# Rebuilds every answered pair's timeline from a session's .log file: when
+# the pair was put on screen (the flip logged for its text), when the key
+# press was handled and the RT the experiment computed from the press's own
+# timestamp. The log is read line by line, and logs are parsed in parallel,
+# one per worker process. Each pair is joined to its CSV row by sentence and
+# pair index, and flagged when the RT from the log disagrees with the CSV.
+#
+# Sentences and pairs are found from EXP and DATA lines, which every session
+# log has. Sentence numbers are only logged at DEBUG level; in a log without
+# them they are taken from the CSV.
+
+LOG_EXTENSION = u'.log'
+TIMELINE_FILE = u'maze_timelines.npz'
+
+# Log timestamps fall on flips, so allow a little over one 60 Hz frame
+RT_TOLERANCE = 0.02
+
+SENTENCE_NUMBER = re.compile(r'Preparing trial for sentence (\d+)')
+DISPLAY_TEXT = re.compile(r'text_(?:left|right): Display text "(.+)"$')
+
+TIMELINE_COLUMNS = [
+    ('session', 'U'),
+    ('sentence_block.thisN', 'i4'),
+    ('sentence_trial.thisN', 'i4'),
+    ('sentence_number', 'i4'),
+    ('target_pos', 'i1'),
+    ('resp', 'i1'),
+    ('resp.acc', 'i1'),
+    ('log.onset', 'f8'),
+    ('log.response', 'f8'),
+    ('log.RT', 'f8'),
+    ('log.computed_RT', 'f8'),
+    ('resp.RT', 'f8'),
+    ('pair.onset_actual', 'f8'),
+    ('csv_row', 'i1'),
+    ('rt_mismatch', 'i1')
+]
+
+def log_lines(log_file):
+    # (time, level, message) for each well-formed line
+    with io.open(log_file, 'r', encoding='utf-8', errors='replace') as log:
+        for line in log:
+            parts = line.rstrip(u'\r\n').split(u'\t', 2)
+            if len(parts) < 3:
+                continue
+            try:
+                stamp = float(parts[0])
+            except ValueError:
+                continue
+            yield stamp, parts[1].strip(), parts[2]
+
+def parse_log(log_file):
+    pairs = []
+    sentence = -1
+    sentence_number = None
+    pair_index = -1
+    practice = False
+    current = None
+
+    for stamp, level, message in log_lines(log_file):
+        match = SENTENCE_NUMBER.match(message)
+        # Practice trials are only marked at DEBUG level, and never log the
+        # main trials' EXP lines either
+        if message.startswith(u'Entered PracticeTrial'):
+            practice = True
+            current = None
+        elif message.startswith(u'Entered SentenceBlock'):
+            practice = False
+        elif practice:
+            continue
+        elif match:
+            sentence_number = int(match.group(1))
+        elif level == u'EXP' and message == u'trial_clock: Reset time':
+            sentence += 1
+            pair_index = -1
+            current = None
+        elif message.startswith(u'Pair target position: ') and sentence >= 0:
+            pair_index += 1
+            current = {
+                'sentence_block.thisN': sentence,
+                'sentence_trial.thisN': pair_index,
+                'sentence_number': sentence_number,
+                'target_pos': message.rsplit(u' ', 1)[1]
+            }
+            pairs.append(current)
+        elif current is None:
+            continue
+        elif 'log.onset' not in current and DISPLAY_TEXT.match(message):
+            current['log.onset'] = stamp
+        elif message == u'Key presses received' and 'log.response' not in current:
+            current['log.response'] = stamp
+        elif level == u'DATA' and message.startswith(u'Response time: '):
+            current['log.computed_RT'] = float(message.rsplit(u' ', 1)[1]) * 1000
+        elif level == u'DATA' and message.startswith(u'Response: '):
+            current['resp'] = message.rsplit(u' ', 1)[1]
+        elif level == u'DATA' and message.startswith(u'Acc: '):
+            current['resp.acc'] = message.rsplit(u' ', 1)[1]
+
+    for pair in pairs:
+        if 'log.onset' in pair and 'log.response' in pair:
+            pair['log.RT'] = (pair['log.response'] - pair['log.onset']) * 1000
+
+    return pairs
+
+def session_file(log_file):
+    stem = log_file[:-len(LOG_EXTENSION)]
+    for extension in (CSV_EXTENSION, STREAM_EXTENSION):
+        if os.path.exists(stem + extension):
+            return stem + extension
+    return None
+
+def session_timeline(log_file, tolerance=RT_TOLERANCE):
+    stem = os.path.basename(log_file)[:-len(LOG_EXTENSION)]
+    pairs = parse_log(log_file)
+
+    rows = {}
+    data_file = session_file(log_file)
+    if data_file is not None:
+        csv_pairs = read_session(data_file, stem)['pairs']
+        keys = zip(csv_pairs['sentence_block.thisN'].tolist(), csv_pairs['sentence_trial.thisN'].tolist())
+        rows = dict((key, i) for i, key in enumerate(keys))
+
+        for pair in pairs:
+            i = rows.get((pair['sentence_block.thisN'], pair['sentence_trial.thisN']))
+            if i is None:
+                continue
+            pair['csv_row'] = 1
+            pair['resp.RT'] = csv_pairs['resp.RT'][i]
+            pair['pair.onset_actual'] = csv_pairs['pair.onset_actual'][i]
+            if pair['sentence_number'] is None:
+                pair['sentence_number'] = csv_pairs['sentence_number'][i]
+
+    for pair in pairs:
+        pair['session'] = stem
+        pair.setdefault('csv_row', 0)
+        mismatch = 'log.RT' in pair and 'resp.RT' in pair and abs(pair['log.RT'] - pair['resp.RT']) > tolerance * 1000
+        pair['rt_mismatch'] = int(mismatch)
+
+    return {'timelines': build_table(pairs, TIMELINE_COLUMNS)}
+
+def _session_timeline(arguments):
+    return session_timeline(*arguments)
+
+def find_logs(data_dir):
+    return [
+        os.path.join(data_dir, filename)
+        for filename in sorted(os.listdir(data_dir)) if filename.endswith(LOG_EXTENSION)
+    ]
+
+def parse_logs(log_files, processes=None, tolerance=RT_TOLERANCE):
+    pool = Pool(processes)
+    try:
+        parts = pool.map(_session_timeline, [(log_file, tolerance) for log_file in log_files], chunksize=1)
+    finally:
+        pool.close()
+        pool.join()
+
+    return concatenate(parts)
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        print('usage: python -m mazeexperiment.analysis.logparse DATA_DIR [OUTPUT_DIR]')
+        return 1
+
+    data_dir = argv[0]
+    output_dir = argv[1] if len(argv) > 1 else os.path.join(data_dir, u'dataset')
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+
+    log_files = find_logs(data_dir)
+    tables = parse_logs(log_files)
+    timeline_file = os.path.join(output_dir, TIMELINE_FILE)
+    np.savez_compressed(timeline_file, **flatten(tables))
+
+    timelines = tables.get('timelines', {})
+    flagged = int(np.sum(timelines['rt_mismatch'])) if timelines else 0
+    print('Parsed {} logs into {}; {} pairs with disagreeing RTs'.format(len(log_files), timeline_file, flagged))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -10,21 +10,35 @@ import numpy as np
 from numpy.random import random, randint, normal, shuffle
 
 from datetime import datetime
-from itertools import chain
-import json
 import os, sys
 
 from .srbox import SRBox
-from .trials import SentenceBlock
+from .responses import KeyboardDevice, SRBoxDevice, SimulatedDevice
+from .trials import SentenceBlock, TEXT_GET_READY, TEXT_FEEDBACK_CORRECT, TEXT_FEEDBACK_INCORRECT
 from .instructions import Instructions
 from .practicetrials import PracticeBlock
+from .trialplan import TrialPlan
+from .stimstore import load_sentences, stimulus_file
+from .datastream import DataStream, STREAM_EXTENSION
+from .logsink import AsyncLogFile
+from .frametiming import FrameTimer, FrameRateMonitor
+from .stimcache import StimulusCache
+from .glyphatlas import GlyphAtlas
+from .scheduler import FrameScheduler
+from .inputs import InputDispatcher, SRBoxEvents, keyboard_events, is_abort
+from .participants import ParticipantIndex
+from .responses import LEFT, RIGHT
+from . import headless as headless_mode
 
 __version__ = "1.0.0"
 
 class Experiment():
-    def __init__(self, exp_name=None, pwd=None, use_srbox=False, autorun=False):
+    def __init__(self, exp_name=None, pwd=None, use_srbox=False, autorun=False, headless=False,
+                 participant=None, data_dir=None, seed=None, log_level=logging.DEBUG):
 
-        self.autorun = autorun
+        # Headless sessions always answer with the simulated response device
+        self.headless = headless
+        self.autorun = autorun or headless
         if pwd is None:
             self.pwd = os.path.dirname(os.path.abspath(__file__)).decode(sys.getfilesystemencoding())
         else:
@@ -32,37 +46,33 @@ class Experiment():
         os.chdir(self.pwd)
         self.exp_name = u'untitled' if exp_name is None else exp_name
 
-        data_dir = u'{}{}{}{}'.format(
-            self.pwd, os.sep,
-            u'participant_data',
-            os.sep
-        )
-
-        data_file_base = u'{}_'.format(self.exp_name)
-        existing = []
-        for dirname, dirnames, filenames in os.walk(data_dir):
-            for filename in filenames:
-                if data_file_base in filename and filename.endswith('.csv'):
-                    filename = filename.split('_')
-                    participant = int(filename[1])
+        if data_dir is None:
+            data_dir = u'{}{}{}'.format(
+                self.pwd, os.sep,
+                u'participant_data'
+            )
+        self.data_dir = data_dir
 
-                    existing.append(participant)
+        self.seed = seed
+        if seed is not None:
+            np.random.seed(seed)
 
-        existing_low = sorted([x for x in existing if x < 500])
-        if not existing:
-            participant_suggestion = 101
-        else:
-            participant_suggestion = existing_low[-1] + 1
+        self.participants = ParticipantIndex(self.data_dir, self.exp_name)
+        participant_suggestion = self.participants.suggestion
 
+        if participant is not None:
+            participant_suggestion = participant
 
         exp_suggestions = {
             u'participant': u''+str(participant_suggestion),
             u'version': u'{}'.format(__version__)
         }
 
-        continue_dlg = True
+        continue_dlg = not self.headless
         dlg_title = self.exp_name
-        last_attempt = int(exp_suggestions['participant'])
+        # A number given by the caller, or one entered again after the
+        # warning, is reused even if it has been allocated before
+        last_attempt = participant
         while continue_dlg:
             dlg = gui.DlgFromDict(
                 dictionary=exp_suggestions,
@@ -74,27 +84,42 @@ class Experiment():
                 core.quit()
             else:
                 part = int(exp_suggestions['participant'])
-                if part in existing and part != last_attempt:
+                if self.participants.allocate(part) or part == last_attempt:
+                    continue_dlg = False
+                else:
                     last_attempt = part
-                    while part in existing:
-                        part += 1
-                    exp_suggestions['participant'] = part
+                    exp_suggestions['participant'] = self.participants.next_free(part)
                     dlg_title = u'Participant {:0>3} Already Exists! ({})'.format(last_attempt, self.exp_name)
-                else:
-                    continue_dlg = False
+
+        if self.headless:
+            self.participants.allocate(int(exp_suggestions['participant']))
 
         self.exp_info = exp_suggestions
+        if seed is not None:
+            self.exp_info['seed'] = seed
 
 
         # self.get_session_info()
 
-        self.window = visual.Window(
-            size=(1920, 1080), fullscr=True, screen=0,
-            allowGUI=True, allowStencil=False,
-            monitor=u'testMonitor', color=[1,1,1], colorSpace='rgb',
-            blendMode='avg', useFBO=True, winType='pyglet')
+        if self.headless:
+            self.timeline = headless_mode.VirtualTimeline()
+            logging.setDefaultClock(self.new_clock())
+            self.visual = headless_mode
+            self.sound = headless_mode
+
+            self.window = headless_mode.NullWindow(self.timeline)
+            runtime = headless_mode.runtime_info(self.window)
+        else:
+            self.visual = visual
+            self.sound = sound
+
+            self.window = visual.Window(
+                size=(1920, 1080), fullscr=True, screen=0,
+                allowGUI=True, allowStencil=False,
+                monitor=u'testMonitor', color=[1,1,1], colorSpace='rgb',
+                blendMode='avg', useFBO=True, winType='pyglet')
 
-        runtime = info.RunTimeInfo(version=self.exp_info['version'], win=self.window)
+            runtime = info.RunTimeInfo(version=self.exp_info['version'], win=self.window)
 
         self.exp_info['exp_name'] = self.exp_name
         self.exp_info['date'] = datetime.today().strftime('%Y-%m-%d')
@@ -111,16 +136,36 @@ class Experiment():
 
         self.participant_id = int(self.exp_info['participant'])
 
-        if 'darwin' in self.exp_info['platform'] or 'linux' in self.exp_info['platform']:
+        self.chinese_font = 'FangSong'
+        if 'darwin' in self.exp_info['platform']:
+            self.chinese_font = 'STFangSong'
+
+        if self.headless or 'darwin' in self.exp_info['platform'] or 'linux' in self.exp_info['platform']:
             self.use_srbox = False
             print('Not using SRBOX')
         else:
             self.use_srbox = use_srbox
             if self.use_srbox:
                 self.srbox = SRBox('COM4', 19200, 0)
-                self.srbox.set_lights([1,1,1,1,1], update=True)
-                core.wait(0.5)
-                self.srbox.set_lights([0,0,0,0,0], update=True)
+                self.srbox.lights.sequence([([1,1,1,1,1], 500), ([0,0,0,0,0], None)])
+
+        # All window and response box input goes through one dispatcher that
+        # is polled once per flip; headless sessions have no input sources
+        self.inputs = InputDispatcher()
+        if not self.headless:
+            self.inputs.add_source(keyboard_events)
+            if self.use_srbox:
+                self.inputs.add_source(SRBoxEvents(self.srbox))
+        self.inputs.add_handler(self.abort_handler)
+
+        if self.headless:
+            self.response_device = SimulatedDevice(seed=seed, timeline=self.timeline)
+        elif self.autorun:
+            self.response_device = SimulatedDevice(seed=seed)
+        elif self.use_srbox:
+            self.response_device = SRBoxDevice(self.srbox, self.inputs)
+        else:
+            self.response_device = KeyboardDevice(self.inputs)
 
         data_file_stem = u'{}_{}_{}'.format(
             self.exp_name,
@@ -128,14 +173,13 @@ class Experiment():
             datetime.today().strftime('%Y-%m-%d')
         )
         # data file name stem
-        if autorun:
+        if self.autorun:
             data_file_stem = u'AUTORUN-DEBUG-DATA-' + data_file_stem
         elif int(self.exp_info['participant']) > 500:
             data_file_stem = u'TESTFILE-' + data_file_stem
 
-        self.data_file_stem = u'{}{}{}{}{}'.format(
-            self.pwd, os.sep,
-            u'participant_data', os.sep,
+        self.data_file_stem = u'{}{}{}'.format(
+            self.data_dir, os.sep,
             data_file_stem
         )
         # print(self.data_file_stem)
@@ -151,7 +195,15 @@ class Experiment():
             dataFileName = self.data_file_stem
         )
 
-        self.log_file = logging.LogFile('{}.log'.format(self.data_file_stem), level=logging.DEBUG, encoding='utf-8')
+        # Every entry is also streamed to disk as it is made, so a crash
+        # mid-session loses at most the current sentence
+        self.data_stream = DataStream(
+            u'{}{}'.format(self.data_file_stem, STREAM_EXTENSION),
+            extra_info=self.exp_info
+        )
+
+        # Log lines are written by a background thread; see flush_logs()
+        self.log_file = AsyncLogFile('{}.log'.format(self.data_file_stem), level=log_level, encoding='utf-8')
         logging.console.setLevel(logging.CRITICAL)
 
         self.end_exp_now = False
@@ -163,19 +215,26 @@ class Experiment():
         else:
             self.frame_dur = 1.0 / 60.0  # could not measure, so guess
 
-        self.global_clock    = core.Clock()
+        self.frame_timer = FrameTimer(self.frame_dur)
+        self.frame_monitor = FrameRateMonitor(1.0 / self.frame_dur)
+        self.scheduler = FrameScheduler(self, self.frame_dur)
+
+        self.global_clock    = self.new_clock()
         # self.instr_clock    = core.Clock()
-        self.sentence_clock = core.Clock()
-        self.pair_clock     = core.Clock()
+        self.sentence_clock = self.new_clock()
+        self.pair_clock     = self.new_clock()
 
         self.routine_timer  = core.CountdownTimer()
         logging.flush()
 
+        self.build_glyph_atlas()
+
         instructions = Instructions(self, self.exp_info)
         instructions.begin_instructions()
+        # Nothing flipped during the instructions belongs to a trial
+        self.frame_timer.reset()
 
         self.prepare_visuals()
-        self.load_latin_square()
         self.load_trials()
         self.load_practice_trials()
 
@@ -183,29 +242,86 @@ class Experiment():
 
         sentence_block = SentenceBlock(self, self.experiment, self.exp_info, self.trials, autorun=self.autorun)
 
+        self.data_stream.close()
+        self.save_frame_timing()
+
+        if self.headless:
+            self.save_data()
+
+        self.log_file.close()
+
+    def new_clock(self):
+        if self.headless:
+            return headless_mode.VirtualClock(self.timeline)
+        return core.Clock()
+
+    def flip(self):
+        flip_time = self.window.flip()
+        if flip_time is None:
+            flip_time = logging.defaultClock.getTime()
+        self.frame_timer.record(flip_time)
+        self.frame_monitor.record(flip_time)
+        self.scheduler.flipped(flip_time)
+        self.inputs.poll()
+        return flip_time
+
+    def recalibrate_frame_rate(self):
+        measured = self.window.getActualFrameRate()
+        logging.warning(u'Frame rate drifted to {:.2f} Hz (calibrated {:.2f} Hz), measured {}'.format(
+            self.frame_monitor.rate, self.frame_monitor.calibrated_rate, measured
+        ))
+        if measured is None:
+            measured = self.frame_monitor.rate
+
+        self.frame_rate = measured
+        self.frame_dur = 1.0 / round(measured)
+        self.frame_timer.frame_dur = self.frame_dur
+        self.scheduler.set_frame_dur(self.frame_dur)
+        self.frame_monitor.calibrate(1.0 / self.frame_dur)
+
+    def save_frame_timing(self):
+        summary = self.frame_timer.session_summary()
+        logging.exp(u'Frame timing: {} dropped frames in {} of {} trials, flip jitter {:.2f} ms'.format(
+            summary['dropped'], summary['trials_with_drops'], summary['trials'], summary['jitter_ms']
+        ))
+        self.frame_timer.save_summary(u'{}.frames.json'.format(self.data_file_stem))
+
+    def next_entry(self):
+        self.experiment.nextEntry()
+        self.data_stream.write_row(self.experiment.entries[-1])
+
+    def flush_logs(self):
         logging.flush()
+        self.log_file.flush()
 
-    def abort(self):
+    def save_data(self):
         self.experiment.saveAsWideText('{}.csv'.format(self.data_file_stem))
+        self.experiment.saveAsPickle(self.data_file_stem)
         logging.flush()
+        # data has been written, so stop the handler saving again on exit
+        self.experiment.abort()
+
+    def abort(self):
+        try:
+            self.data_stream.close()
+            self.experiment.saveAsWideText('{}.csv'.format(self.data_file_stem))
+            self.log_file.close()
+        except Exception as error:
+            logging.error(u'Could not save data on abort: {}'.format(error))
         # make sure everything is closed down
         try:
             self.experiment.abort()  # or data files will save again on exit
-        except: pass
+        except Exception: pass
         try:
             self.window.close()
-        except: pass
-        try:
-            core.quit()
-        except: pass
+        except Exception: pass
+        # The SystemExit raised here is what ends the session
+        core.quit()
 
-    def check_abort(self):
-        keys = event.getKeys(keyList=['escape'], modifiers=True)
-        if keys and (keys[0][0] == 'escape' and keys[0][1]['ctrl'] and keys[0][1]['alt']):
-            try:
-                self.abort()
-            except:
-                pass
+    def abort_handler(self, input_event):
+        if is_abort(input_event):
+            self.abort()
+            return True
 
     def get_session_info(self):
         dlg = gui.DlgFromDict(
@@ -221,28 +337,32 @@ class Experiment():
 
     def prepare_visuals(self):
 
-        if 'darwin' in self.exp_info['platform']:
-            CHINESE_FONT = 'STFangSong'
-        elif 'win' in self.exp_info['platform']:
-            CHINESE_FONT = 'FangSong'
+        CHINESE_FONT = self.chinese_font
+
+        pair_styles = {
+            LEFT: dict(
+                name='text_left',
+                font=CHINESE_FONT,   pos=(-0.1, 0),      height=0.25,
+                wrapWidth=None,     color=(-1, -1, -1), colorSpace='rgb',
+                opacity=1,          depth=0.0,          ori=0,
+                alignHoriz='right', autoLog=False
+            ),
+            RIGHT: dict(
+                name='text_right',
+                font=CHINESE_FONT,   pos=(0.1, 0),       height=0.25,
+                wrapWidth=None,     color=(-1, -1, -1), colorSpace='rgb',
+                opacity=1,          depth=0.0,          ori=0,
+                alignHoriz='left', autoLog=False
+            )
+        }
 
-        self.text_left = visual.TextStim(
-            win=self.window,    name='text_left',   text='',
-            font=CHINESE_FONT,   pos=(-0.1, 0),      height=0.25,
-            wrapWidth=None,     color=(-1, -1, -1), colorSpace='rgb',
-            opacity=1,          depth=0.0,          ori=0,
-            alignHoriz='right', autoLog=False
-        )
+        self.text_left = self.visual.TextStim(win=self.window, text='', **pair_styles[LEFT])
+        self.text_right = self.visual.TextStim(win=self.window, text='', **pair_styles[RIGHT])
 
-        self.text_right = visual.TextStim(
-            win=self.window,    name='text_right',  text='',
-            font=CHINESE_FONT,   pos=(0.1, 0),       height=0.25,
-            wrapWidth=None,     color=(-1, -1, -1), colorSpace='rgb',
-            opacity=1,          depth=0.0,          ori=0,
-            alignHoriz='left', autoLog=False
-        )
+        # Ready-rendered word stimuli for SentenceTrial.show_pair()
+        self.pair_cache = StimulusCache(self.visual.TextStim, self.window, pair_styles)
 
-        self.fixation = visual.TextStim(
+        self.fixation = self.visual.TextStim(
             win=self.window,    name='fixation',    text='+',
             font='Courier New', pos=(0, 0),         height=0.25,
             wrapWidth=None,     color=(-1, -1, -1), colorSpace='rgb',
@@ -250,7 +370,7 @@ class Experiment():
             autoLog=False
         )
 
-        self.acc_feedback = visual.TextStim(
+        self.acc_feedback = self.visual.TextStim(
             win=self.window,    name='acc_feedback',text='',
             font=CHINESE_FONT, pos=(0, 0),         height=0.25,
             wrapWidth=None,     color=(-1,-1,-1),   colorSpace='rgb',
@@ -258,7 +378,7 @@ class Experiment():
             autoLog=False
         )
 
-        self.message = visual.TextStim(
+        self.message = self.visual.TextStim(
             win=self.window,    name='message',text='',
             font=CHINESE_FONT, pos=(0, 0),         height=0.25,
             wrapWidth=None,     color=(-1,-1,-1),   colorSpace='rgb',
@@ -269,111 +389,79 @@ class Experiment():
         # self.text_left.autoDraw  = True
         # self.text_right.autoDraw = True
 
+    def build_glyph_atlas(self):
+        data_dir = u'{}{}data{}'.format(self.pwd, os.sep, os.sep)
+        sentence_files = [
+            stimulus_file(u'{}trials.json'.format(data_dir)),
+            stimulus_file(u'{}practice_trials.json'.format(data_dir))
+        ]
+        source_files = [u'{}instructions_timeline.json'.format(data_dir)]
+        # Messages the trial modules show themselves
+        texts = [TEXT_GET_READY, TEXT_FEEDBACK_CORRECT, TEXT_FEEDBACK_INCORRECT]
+
+        # Every font and height that text is shown in: pairs, feedback and
+        # messages, the instruction paragraphs and answer options, the
+        # practice pairs and the practice sentence progress
+        faces = [(self.chinese_font, height) for height in (0.1, 0.12, 0.2, 0.25, 0.3)]
+        faces.append(('SimSun', 0.1))
+
+        self.glyph_atlas = GlyphAtlas(self.visual.TextStim, self.window)
+        self.glyph_atlas.build(faces, self.glyph_atlas.charset(sentence_files, source_files, texts))
+
     def load_practice_trials(self):
         practice_file = u'{}{}data{}practice_trials.json'.format(
             self.pwd, os.sep, os.sep
         )
 
-        practice_file = open(practice_file, 'r')
-        self.practice_trials = json.load(practice_file, encoding='utf-8')['sentences']
-        practice_file.close()
+        # The practice block's trial handler wants a list
+        self.practice_trials = list(load_sentences(stimulus_file(practice_file)))
 
         logging.info(u'Practice trials loaded')
         logging.flush()
 
     def load_trials(self):
-        trials_file = u'{}{}data{}trials.json'.format(
+        trials_file = stimulus_file(u'{}{}data{}trials.json'.format(
             self.pwd, os.sep, os.sep
-        )
-
-        trials_file = open(trials_file, 'r')
-        self.trials = json.load(trials_file, encoding='utf-8')['sentences']
-        trials_file.close()
-
-        # print('Participant ID # {}'.format(self.participant_id))
-        # print('Participant ID % 23 {}'.format((self.participant_id%46)))
-        # print('Participant ID % 100 {}'.format((self.participant_id%100)))
-
-        participant_mod = self.participant_id# % 100
-
-        # print('Participant MOD % 23 {}'.format((participant_mod%23)))
-
-        first_row = self.participant_id % 23
-        last_row = (first_row + 5) % 23
-        # last_row = (first_row + 4) % 20
-
-        # logging.info(u'Latin square first row: {}, last row: {}'.format(first_row, last_row-1))
-
-        square = []
-        # if first_row <= 16:
-        #     square = self.latin_square[first_row:first_row+5]
-        # else:
-        #     square = self.latin_square[first_row:] + self.latin_square[:last_row]
-
-        for i in range(5):
-            row_id = ((participant_mod % 46) + (i * (int((participant_mod - 1) / 46) + 1))) % 46
-            square.append(self.latin_square[row_id])
-            logging.info(u'       {}'.format(''.join(['{:>4}'.format((x+(i*23))) for x in range(1,24)])))
-            logging.info(u'Row {:>2}:{}'.format(row_id, ''.join(['{:>4}'.format(x) for x in self.latin_square[row_id]])))
-
-        square = [int(x) for x in chain.from_iterable(square)]
-        # print('Square:', square)
-
-        logging.info(u'Participant latin square: {}'.format(square))
-
-        for trial in self.trials:
-            trial_num = int(trial['sentence_number']) - 1
-            if square[trial_num] % 4 == 0:
-                trial['condition'] = 1
-            elif (square[trial_num] - 1) % 4 == 0:
-                trial['condition'] = 2
-            elif (square[trial_num] - 2) % 4 == 0:
-                trial['condition'] = 3
-            else:
-                trial['condition'] = 4
-
-            # print(trial['sentence_number'], ':', trial['condition'], end=' | ')
-
-        logging.flush()
-
-    def load_latin_square(self):
-        square_file = u'{}{}data{}latinsquare_23.txt'.format(
+        ))
+        cache_dir = u'{}{}data{}cache'.format(
             self.pwd, os.sep, os.sep
         )
 
-        square_file = open(square_file, 'r')
+        # Conditions, critical distractors and the target/alternative strings
+        # are compiled once per participant and read back from the cache. The
+        # Latin square is generated to fit the number of trials.
+        self.trial_plan = TrialPlan(trials_file, None, cache_dir)
+        self.trials = self.trial_plan.load(self.participant_id)
 
-        self.latin_square = []
-        for line in square_file:
-            line = line.strip()
-            self.latin_square.append(line.split('\t'))
-            # print(self.latin_square[-1])
-
-        square_file.close()
+        logging.flush()
 
     def display_message(self, message, time=None, keypress=None, color=None):
         self.message.text = message
         logging.info(u'{}: Set message to "{}"'.format(self.message.name, message))
         self.message.color = (-1, -1, -1) if color is None else color
-        self.message.draw()
         self.window.logOnFlip(u'{}: Display message "{}"'.format(self.message.name, message), logging.EXP, self.message)
-        self.window.flip()
 
         if time is not None:
-            frames = int(round(time / self.frame_dur))-1
+            frames = self.scheduler.frames(time)
             self.window.logOnFlip(
                 'Begin show blank screen for {:.2f} ({} frames/{} actual est.)'.format(time, frames, (frames*self.frame_dur)),
                 logging.EXP
             )
-            for i in range(frames):
-                self.message.draw()
-                self.window.flip()
-                if keypress is not None:
-                    keys = event.getKeys(keyList=keypress)
-                    if len(keys) > 0:
-                        return keys
+            check_keys = None
+            if keypress is not None:
+                # Only presses from after the message went up count
+                onset = core.getTime()
+                check_keys = lambda: [
+                    input_event.key for input_event in self.inputs.take(keys=keypress, source='keyboard', since=onset)
+                ]
+            # Messages come between trials, so they are not frame timed
+            keys = self.scheduler.present('message', frames, draw=self.message.draw, until=check_keys, timed=False)
+            if keys:
+                return keys
         else:
+            self.message.draw()
+            self.flip()
             if keypress is not None:
-                return event.waitKeys(keyList=keypress)
+                return [self.inputs.wait(keys=keypress, source='keyboard').key]
 
         self.window.logOnFlip(u'{}: Hide message "{}"'.format(self.message.name, message), logging.EXP, self.message)
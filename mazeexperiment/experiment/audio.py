@@ -0,0 +1,198 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function
+from psychopy import logging
+from psychopy.constants import PLAYING
+
+import numpy as np
+
+from contextlib import closing
+from threading import Condition, Thread
+import os
+import wave
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+try:
+    import soundfile
+except ImportError:
+    soundfile = None
+
+# Instruction clips are decoded on a background thread a couple of clips
+# ahead of the one playing, and dropped again once they have finished, so
+# only the first clip has to be ready before the instructions start. With
+# soundfile installed, decoded clips are also kept as FLAC in the cache
+# directory, which is a fraction of the size of the WAV files to read back.
+# Headless sessions have nothing to play the clips on, so with decode=False
+# nothing is read and every clip is a silent sound.
+
+LOOKAHEAD = 2
+CACHE_EXTENSION = u'.flac'
+
+_WAV_TYPES = {1: np.uint8, 2: np.int16, 4: np.int32}
+
+def read_wav(wav_file):
+    with closing(wave.open(wav_file, 'rb')) as wav:
+        channels = wav.getnchannels()
+        width = wav.getsampwidth()
+        rate = wav.getframerate()
+        frames = wav.readframes(wav.getnframes())
+
+    data = np.frombuffer(frames, dtype=_WAV_TYPES[width]).astype(np.float32)
+    if width == 1:
+        data = (data - 128) / 128
+    else:
+        data /= float(2 ** (8 * width - 1))
+
+    return data.reshape(-1, channels), rate
+
+class InstructionAudio():
+    def __init__(self, sound_class, clip_files, cache_dir=None, lookahead=LOOKAHEAD, decode=True):
+        self.sound_class = sound_class
+        self.clip_files = clip_files
+        self.cache_dir = cache_dir if soundfile is not None else None
+        self.lookahead = lookahead
+        self.decode_clips = decode
+
+        self.sounds = {}
+        self.current = None
+        self.late = None
+        self.failed = set()
+
+        self._decoded = {}
+        self._requested = set()
+        self._ready = Condition()
+        self._queue = queue.Queue()
+        self._loader_thread = None
+        if decode:
+            self._loader_thread = Thread(target=self._loader)
+            self._loader_thread.daemon = True
+            self._loader_thread.start()
+
+    def cache_file(self, index):
+        name = os.path.splitext(os.path.basename(self.clip_files[index]))[0]
+        return os.path.join(self.cache_dir, name + CACHE_EXTENSION)
+
+    def decode(self, index):
+        clip_file = self.clip_files[index]
+        if self.cache_dir is None:
+            return read_wav(clip_file)
+
+        cache_file = self.cache_file(index)
+        if os.path.exists(cache_file) and os.path.getmtime(cache_file) >= os.path.getmtime(clip_file):
+            return soundfile.read(cache_file, dtype='float32', always_2d=True)
+
+        data, rate = read_wav(clip_file)
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+        temp_file = u'{}.{}.tmp'.format(cache_file, os.getpid())
+        soundfile.write(temp_file, data, rate, format='FLAC')
+        try:
+            os.rename(temp_file, cache_file)
+        except OSError:
+            os.remove(temp_file)
+
+        return data, rate
+
+    def _loader(self):
+        while True:
+            index = self._queue.get()
+            if index is None:
+                return
+
+            try:
+                clip = self.decode(index)
+            except Exception as error:
+                logging.warning(u'Could not load instruction audio {}: {}'.format(self.clip_files[index], error))
+                clip = None
+
+            with self._ready:
+                self._decoded[index] = clip
+                self._ready.notify_all()
+
+    def prefetch(self, index):
+        if not self.decode_clips:
+            return
+        for i in range(index, index + self.lookahead):
+            if i in self.clip_files and i not in self._requested:
+                self._requested.add(i)
+                self._queue.put(i)
+
+    def sound(self, index):
+        if index in self.sounds:
+            return self.sounds[index]
+        if index in self.failed:
+            return None
+        if not self.decode_clips:
+            self.sounds[index] = self.sound_class()
+            return self.sounds[index]
+
+        self.prefetch(index)
+        with self._ready:
+            while index not in self._decoded:
+                self._ready.wait()
+            clip = self._decoded.pop(index)
+
+        if clip is None:
+            self.failed.add(index)
+            return None
+
+        data, rate = clip
+        self.sounds[index] = self.sound_class(value=data, sampleRate=rate)
+        return self.sounds[index]
+
+    def release_finished(self):
+        for index, sound in list(self.sounds.items()):
+            if index != self.current and getattr(sound, 'status', None) != PLAYING:
+                del self.sounds[index]
+
+    def ready(self, index):
+        if not self.decode_clips:
+            return True
+        with self._ready:
+            return index in self._decoded or index in self.sounds or index in self.failed
+
+    def preload(self, indices):
+        for index in indices:
+            if index in self.clip_files:
+                self.sound(index)
+
+    def play(self, index, wait=True):
+        if index not in self.clip_files:
+            return
+
+        if not wait and not self.ready(index):
+            # Start it from update() once decoded rather than hold up the frame
+            logging.warning(u'Instruction audio {} not loaded in time'.format(index))
+            self.prefetch(index)
+            self.late = index
+            return
+
+        self.late = None
+        sound = self.sound(index)
+        self.release_finished()
+        if sound is not None:
+            sound.play()
+        self.current = index
+        self.prefetch(index + 1)
+
+    def update(self):
+        if self.late is not None and self.ready(self.late):
+            self.play(self.late)
+
+    def stop(self):
+        self.late = None
+        for sound in self.sounds.values():
+            try:
+                sound.stop()
+            except Exception:
+                pass
+
+    def close(self):
+        self.stop()
+        self.sounds = {}
+        if self._loader_thread is not None:
+            self._queue.put(None)
@@ -0,0 +1,122 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+
+import os
+
+# Each participant reads BLOCKS rows of the Latin square, stepping through
+# the rows from one that depends on the participant number. A cell's value
+# modulo the number of conditions picks the condition (with 4: 0 is 1, 1 is 2,
+# 2 is 3, 3 is 4), so condition vectors for any number of participants come
+# out of a few array operations. Conditions are only balanced within a row
+# when the square's width is a multiple of the number of conditions.
+
+BLOCKS = 5
+CONDITION_COUNT = 4
+
+# Squares are Williams designs: every row is a Latin square row and every
+# item follows every other item equally often, counting rows in sequence.
+# For an odd number of items the mirrored rows are added, doubling the rows.
+# Generated squares are kept in memory and in the cache directory by size.
+_squares = {}
+
+def williams_square(n):
+    # First row 0, 1, n-1, 2, n-2, ...; each later row adds one to the last
+    j = np.arange(n)
+    first = np.where(j % 2 == 1, (j + 1) // 2, (n - j // 2) % n)
+    square = (first + j.reshape(-1, 1)) % n + 1
+    if n % 2 == 1:
+        square = np.vstack((square, square[:, ::-1]))
+
+    return square.astype(np.int32)
+
+def validate_square(square):
+    square = np.asarray(square)
+    rows, n = square.shape
+    values = np.arange(1, n + 1)
+
+    if not (np.sort(square, axis=1) == values).all():
+        raise ValueError(u'Latin square rows are not permutations of 1-{}'.format(n))
+    if rows % n or not (np.sort(square.reshape(-1, n, n), axis=1) == values.reshape(-1, 1)).all():
+        raise ValueError(u'Latin square columns do not contain every item once per {} rows'.format(n))
+
+    # Count each ordered pair of neighbours; a balanced square has every
+    # pair of different items equally often and no item next to itself
+    follows = np.zeros((n + 1, n + 1), dtype=np.int64)
+    np.add.at(follows, (square[:, :-1].ravel(), square[:, 1:].ravel()), 1)
+    follows = follows[1:, 1:]
+    expected = rows // n
+    if n > 1 and not (follows[~np.eye(n, dtype=bool)] == expected).all():
+        raise ValueError(u'Latin square is not carryover balanced')
+
+    return square
+
+def design_shape(items, conditions=CONDITION_COUNT):
+    # The narrowest square that divides the items into whole blocks and has
+    # every condition equally often in a row, at least twice
+    for n in range(2 * conditions, items + 1, conditions):
+        if items % n == 0:
+            return n, items // n
+
+    # Otherwise one block, as wide as needed to cover the items with every
+    # condition equally often; the last cells of the row go unused
+    return -(-items // conditions) * conditions, 1
+
+def cached_square(n, cache_dir=None):
+    if n in _squares:
+        return _squares[n]
+
+    cache_file = None if cache_dir is None else os.path.join(cache_dir, u'williams_{}.npy'.format(n))
+    if cache_file is not None and os.path.exists(cache_file):
+        square = validate_square(np.load(cache_file))
+    else:
+        square = validate_square(williams_square(n))
+        if cache_file is not None:
+            if not os.path.isdir(cache_dir):
+                os.makedirs(cache_dir)
+            temp_file = u'{}.{}.tmp.npy'.format(cache_file[:-4], os.getpid())
+            np.save(temp_file, square)
+            try:
+                os.rename(temp_file, cache_file)
+            except OSError:
+                os.remove(temp_file)
+
+    _squares[n] = square
+    return square
+
+def load_square(square_file):
+    # Split on any whitespace; some rows end in a stray tab
+    return np.loadtxt(square_file, dtype=np.int32, ndmin=2)
+
+def square_rows(square, participant_ids, blocks=BLOCKS):
+    # Row of the square used for each block, shape (participants, blocks)
+    rows = len(square)
+    ids = np.asarray(participant_ids, dtype=np.int64).reshape(-1, 1)
+    step = ((ids - 1) / rows).astype(np.int64) + 1
+    return ((ids % rows) + np.arange(blocks) * step) % rows
+
+def condition_vectors(square, participant_ids, blocks=BLOCKS, conditions=CONDITION_COUNT):
+    # Condition of every item, in sentence number order, for each participant
+    cells = square[square_rows(square, participant_ids, blocks)]
+    return (cells.reshape(len(cells), -1) % conditions + 1).astype(np.int8)
+
+def balance_statistics(conditions, condition_count=CONDITION_COUNT):
+    # How often each item appears in each condition across a cohort
+    conditions = np.asarray(conditions)
+    counts = np.stack([
+        (conditions == condition).sum(axis=0) for condition in range(1, condition_count + 1)
+    ])
+    spread = counts.max(axis=0) - counts.min(axis=0)
+
+    return {
+        'participants': len(conditions),
+        'counts': counts,
+        'condition_totals': counts.sum(axis=1),
+        'item_spread': spread,
+        'max_spread': int(spread.max()) if spread.size else 0,
+        # Largest spread as a fraction of the mean number of times an item
+        # appears in one condition
+        'relative_spread': float(spread.max() * condition_count / len(conditions)) if spread.size else 0.0
+    }
@@ -0,0 +1,139 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function
+
+from threading import Thread
+import csv
+import io
+import json
+import os, sys
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+# Append-only session data: one JSON record per line. The first record holds
+# the session info that the wide CSV repeats on every row; every following
+# record is one ExperimentHandler entry. A crash can at worst truncate the
+# last line, which recover() skips.
+
+STREAM_EXTENSION = u'.stream.jsonl'
+
+def open_csv(path, mode='r'):
+    if sys.version_info[0] < 3:
+        return open(path, mode + 'b')
+    return io.open(path, mode, newline='', encoding='utf-8')
+
+def _plain(value):
+    if hasattr(value, 'item'):
+        return value.item()
+    return u'{}'.format(value)
+
+class DataStream():
+    def __init__(self, stream_file, extra_info=None):
+        self.stream_file = stream_file
+        self.extra_info = {} if extra_info is None else extra_info
+
+        self._queue = queue.Queue()
+        self._file = open(stream_file, 'ab')
+        self._writer_thread = Thread(target=self._writer)
+        self._writer_thread.daemon = True
+        self._writer_thread.start()
+
+        self._queue.put(('record', {'info': dict(self.extra_info)}))
+
+    def write_row(self, entry):
+        row = {}
+        for name, value in entry.items():
+            if name in self.extra_info and self.extra_info[name] is value:
+                continue
+            row[name] = value
+        self._queue.put(('record', {'row': row}))
+
+    def sync(self):
+        self._queue.put(('sync', None))
+
+    def close(self):
+        if self._writer_thread.is_alive():
+            self._queue.put(('close', None))
+            self._writer_thread.join()
+
+    def _writer(self):
+        while True:
+            command, record = self._queue.get()
+            if command == 'record':
+                line = json.dumps(record, ensure_ascii=False, default=_plain)
+                if not isinstance(line, bytes):
+                    line = line.encode('utf-8')
+                self._file.write(line + b'\n')
+                continue
+
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            if command == 'close':
+                self._file.close()
+                return
+
+def read_stream(stream_file):
+    info = {}
+    rows = []
+    with io.open(stream_file, 'r', encoding='utf-8') as stream:
+        for line in stream:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # Partial line from a write cut short by a crash
+                continue
+
+            if 'info' in record:
+                info.update(record['info'])
+            elif 'row' in record:
+                rows.append(record['row'])
+
+    return info, rows
+
+def recover(stream_file, csv_file=None):
+    if csv_file is None:
+        csv_file = stream_file[:-len(STREAM_EXTENSION)] + u'.csv'
+
+    info, rows = read_stream(stream_file)
+
+    fieldnames = []
+    for row in rows:
+        for name in row:
+            if name not in fieldnames:
+                fieldnames.append(name)
+    for name in info:
+        if name not in fieldnames:
+            fieldnames.append(name)
+
+    with open_csv(csv_file, 'w') as output:
+        writer = csv.writer(output)
+        writer.writerow(fieldnames)
+        for row in rows:
+            values = []
+            for name in fieldnames:
+                value = row.get(name, info.get(name, u''))
+                if value is None:
+                    value = u''
+                value = u'{}'.format(value)
+                if sys.version_info[0] < 3:
+                    value = value.encode('utf-8')
+                values.append(value)
+            writer.writerow(values)
+
+    return csv_file
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        print('usage: python -m mazeexperiment.experiment.datastream FILE{} [OUTPUT.csv]'.format(STREAM_EXTENSION))
+        return 1
+
+    csv_file = recover(argv[0], argv[1] if len(argv) > 1 else None)
+    print('Recovered {}'.format(csv_file))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,195 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+
+import io
+import json
+
+# Flip timestamps are kept per trial in a preallocated array. A timed phase
+# (blank, fixation, feedback, ...) covers the flips between begin_phase() and
+# end_phase() and lasts until the first flip after it, which removes it from
+# the screen. Flips outside a phase, such as a pair waiting for a response,
+# are recorded but not judged.
+
+FRAME_CAPACITY = 4096
+
+MONITOR_SAMPLES = 240
+MONITOR_MIN_SAMPLES = 30
+RATE_TOLERANCE = 0.05
+
+class FrameRateMonitor():
+    # Estimates the refresh rate from the flips the experiment makes anyway,
+    # instead of stopping to flip a blank window. Gaps much longer than a
+    # frame (waiting for a response) are not refresh intervals and are
+    # skipped; the median keeps the odd dropped frame from biasing the rate.
+    def __init__(self, frame_rate, tolerance=RATE_TOLERANCE, samples=MONITOR_SAMPLES):
+        self.tolerance = tolerance
+        self.intervals = np.zeros(samples, dtype=np.float64)
+        self.calibrate(frame_rate)
+
+    def calibrate(self, frame_rate):
+        self.calibrated_rate = frame_rate
+        self.max_interval = 2.0 / frame_rate
+        self.count = 0
+        self.last_flip = None
+
+    def record(self, flip_time):
+        if self.last_flip is not None:
+            interval = flip_time - self.last_flip
+            if 0 < interval < self.max_interval:
+                self.intervals[self.count % len(self.intervals)] = interval
+                self.count += 1
+        self.last_flip = flip_time
+
+    @property
+    def rate(self):
+        if self.count < MONITOR_MIN_SAMPLES:
+            return self.calibrated_rate
+        return 1.0 / np.median(self.intervals[:min(self.count, len(self.intervals))])
+
+    def drifted(self):
+        return abs(self.rate - self.calibrated_rate) > self.tolerance * self.calibrated_rate
+
+class FrameTimer():
+    def __init__(self, frame_dur, capacity=FRAME_CAPACITY):
+        self.frame_dur = frame_dur
+        self.times = np.zeros(capacity, dtype=np.float64)
+        self.count = 0
+        self.segments = []
+
+        self.session = {
+            'trials': 0,
+            'trials_with_drops': 0,
+            'dropped': 0,
+            'intervals': 0,
+            'interval_sum': 0.0,
+            'interval_sumsq': 0.0,
+            'max_interval': 0.0,
+            'phases': {}
+        }
+
+    def begin_phase(self, phase, intended):
+        self.segments.append([phase, self.count, None, intended])
+
+    def end_phase(self):
+        if self.segments and self.segments[-1][2] is None:
+            self.segments[-1][2] = self.count
+
+    def record(self, flip_time):
+        if self.count == len(self.times):
+            self.times = np.concatenate([self.times, np.zeros(len(self.times))])
+        self.times[self.count] = flip_time
+        self.count += 1
+
+    def reset(self):
+        self.count = 0
+        self.segments = []
+
+    def dropped(self, intervals):
+        if not len(intervals):
+            return 0
+        return int(np.maximum(np.round(intervals / self.frame_dur) - 1, 0).sum())
+
+    def segment_stats(self):
+        times = self.times[:self.count]
+        for phase, start, end, intended in self.segments:
+            if end is None:
+                end = self.count
+            if end == start:
+                continue
+            elif end < self.count:
+                stamps = times[start:end + 1]
+                actual = stamps[-1] - stamps[0]
+            else:
+                # Nothing has been flipped after this phase yet, so assume its
+                # last frame stayed up for exactly one frame
+                stamps = times[start:end]
+                actual = stamps[-1] - stamps[0] + self.frame_dur
+
+            yield phase, intended, actual, np.diff(stamps)
+
+    def summary(self):
+        phases = {}
+        all_intervals = []
+        for phase, intended, actual, intervals in self.segment_stats():
+            stats = phases.setdefault(phase, {
+                'segments': 0, 'intended': 0.0, 'actual': 0.0, 'dropped': 0, 'max_error': 0.0
+            })
+            stats['segments'] += 1
+            stats['intended'] += intended
+            stats['actual'] += actual
+            stats['dropped'] += self.dropped(intervals)
+            stats['max_error'] = max(stats['max_error'], abs(actual - intended))
+            all_intervals.append(intervals)
+
+        intervals = np.concatenate(all_intervals) if all_intervals else np.zeros(0)
+        return {
+            'dropped': self.dropped(intervals),
+            'jitter': float(intervals.std()) if len(intervals) else 0.0,
+            'intervals': intervals,
+            'phases': phases
+        }
+
+    def end_trial(self):
+        summary = self.summary()
+        self.reset()
+
+        session = self.session
+        intervals = summary['intervals']
+        session['trials'] += 1
+        session['dropped'] += summary['dropped']
+        if summary['dropped']:
+            session['trials_with_drops'] += 1
+        if len(intervals):
+            session['intervals'] += len(intervals)
+            session['interval_sum'] += float(intervals.sum())
+            session['interval_sumsq'] += float((intervals ** 2).sum())
+            session['max_interval'] = max(session['max_interval'], float(intervals.max()))
+
+        for phase, stats in summary['phases'].items():
+            totals = session['phases'].setdefault(phase, {
+                'segments': 0, 'intended': 0.0, 'actual': 0.0, 'dropped': 0, 'max_error': 0.0
+            })
+            for name in ('segments', 'intended', 'actual', 'dropped'):
+                totals[name] += stats[name]
+            totals['max_error'] = max(totals['max_error'], stats['max_error'])
+
+        return summary
+
+    def session_summary(self):
+        session = self.session
+        n = session['intervals']
+        mean = session['interval_sum'] / n if n else 0.0
+        jitter = np.sqrt(max(session['interval_sumsq'] / n - mean ** 2, 0.0)) if n else 0.0
+
+        phases = {}
+        for phase, totals in session['phases'].items():
+            phases[phase] = {
+                'segments': totals['segments'],
+                'dropped': totals['dropped'],
+                'intended_ms': totals['intended'] * 1000,
+                'actual_ms': totals['actual'] * 1000,
+                'mean_error_ms': (totals['actual'] - totals['intended']) * 1000 / totals['segments'],
+                'max_error_ms': totals['max_error'] * 1000
+            }
+
+        return {
+            'frame_dur_ms': self.frame_dur * 1000,
+            'trials': session['trials'],
+            'trials_with_drops': session['trials_with_drops'],
+            'dropped': session['dropped'],
+            'flip_intervals': n,
+            'mean_interval_ms': mean * 1000,
+            'jitter_ms': float(jitter) * 1000,
+            'max_interval_ms': session['max_interval'] * 1000,
+            'phases': phases
+        }
+
+    def save_summary(self, summary_file):
+        text = json.dumps(self.session_summary(), indent=2, sort_keys=True)
+        if isinstance(text, bytes):
+            text = text.decode('utf-8')
+        with io.open(summary_file, 'w', encoding='utf-8') as summary:
+            summary.write(text)
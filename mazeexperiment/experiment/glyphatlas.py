@@ -0,0 +1,71 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function
+from psychopy import logging
+
+from .stimstore import StimulusStore, load_sentences
+from .instructionplan import load_timeline, timeline_strings
+
+ATLAS_LINE = 40
+
+# Pyglet rasterises glyphs into one texture atlas per font and size the first
+# time they are laid out, and later text in that font is drawn from it. At
+# startup every character the session can show is laid out once for each
+# face, so no glyph has to be rasterised mid-trial. The atlases live on the
+# GPU and are filled again on every launch.
+
+def sentence_strings(sentences):
+    for sentence in sentences:
+        for key in ('full_sentence', 'critical_target'):
+            if sentence.get(key):
+                yield sentence[key]
+        for key in ('distractors', 'original_distractors'):
+            for value in sentence.get(key, {}).values():
+                if value:
+                    yield value
+        for pair in sentence['sentence']:
+            for word in pair:
+                yield word
+
+def source_strings(source_file):
+    # The texts of an instruction timeline
+    return timeline_strings(load_timeline(source_file))
+
+def collect_charset(strings):
+    characters = set()
+    for string in strings:
+        if isinstance(string, bytes):
+            string = string.decode('utf-8')
+        characters.update(string)
+    return u''.join(sorted(c for c in characters if not c.isspace()))
+
+class GlyphAtlas():
+    def __init__(self, text_stim, window):
+        self.text_stim = text_stim
+        self.window = window
+        self.stims = []
+
+    def charset(self, sentence_files, source_files, texts=()):
+        strings = list(texts)
+        for path in sentence_files:
+            sentences = load_sentences(path)
+            # A store's string table already holds every string it uses once
+            if isinstance(sentences, StimulusStore):
+                strings.extend(sentences.strings())
+            else:
+                strings.extend(sentence_strings(sentences))
+        for path in source_files:
+            strings.extend(source_strings(path))
+        return collect_charset(strings)
+
+    def build(self, faces, charset):
+        lines = u'\n'.join(charset[i:i + ATLAS_LINE] for i in range(0, len(charset), ATLAS_LINE))
+        for font, height in faces:
+            # The stimuli are kept so that their fonts, and with them the
+            # glyph textures, stay loaded for the whole session
+            self.stims.append(self.text_stim(
+                win=self.window, name='glyph_atlas', text=lines,
+                font=font, height=height, wrapWidth=None, autoLog=False
+            ))
+
+        logging.info(u'Glyph atlas: {} characters in {} faces'.format(len(charset), len(faces)))
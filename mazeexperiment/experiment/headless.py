@@ -0,0 +1,126 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function
+from psychopy import logging
+
+import numpy as np
+
+import platform
+import socket
+import sys
+
+# Stand-ins for the PsychoPy window, stimuli, sounds and clocks so that a
+# whole session can run without a display. Time only moves when a frame is
+# flipped or a simulated response is made, so sessions run as fast as the
+# experiment code itself.
+
+class VirtualTimeline():
+    def __init__(self, start=0.0):
+        self.now = start
+
+    def advance(self, duration):
+        self.now += duration
+
+    def getTime(self):
+        return self.now
+
+class VirtualClock():
+    def __init__(self, timeline):
+        self.timeline = timeline
+        self._start = timeline.now
+
+    def getTime(self):
+        return self.timeline.now - self._start
+
+    def reset(self, newT=0.0):
+        self._start = self.timeline.now + newT
+
+    def add(self, t):
+        self._start += t
+
+class NullWindow():
+    def __init__(self, timeline, frame_rate=60.0, size=(1920, 1080)):
+        self.timeline = timeline
+        self.frame_rate = frame_rate
+        self.frame_dur = 1.0 / frame_rate
+        self.size = np.array(size)
+        self.color = [1, 1, 1]
+        self.winType = 'headless'
+
+        self._to_log = []
+        self._call_on_flip = []
+
+    def flip(self, clearBuffer=True):
+        self.timeline.advance(self.frame_dur)
+        now = self.timeline.now
+
+        for function, args, kwargs in self._call_on_flip:
+            function(*args, **kwargs)
+        self._call_on_flip = []
+
+        for message, level, obj in self._to_log:
+            logging.log(message, level, t=now, obj=obj)
+        self._to_log = []
+
+        return now
+
+    def logOnFlip(self, msg, level, obj=None):
+        self._to_log.append((msg, level, obj))
+
+    def callOnFlip(self, function, *args, **kwargs):
+        self._call_on_flip.append((function, args, kwargs))
+
+    def getActualFrameRate(self, *args, **kwargs):
+        return self.frame_rate
+
+    def clearBuffer(self):
+        pass
+
+    def close(self):
+        pass
+
+class NullStim(object):
+    def __init__(self, win=None, **kwargs):
+        self.win = win
+        self.autoDraw = False
+        self.pos = (0, 0)
+        for name, value in kwargs.items():
+            setattr(self, name, value)
+
+    def __setattr__(self, name, value):
+        # Instructions animate stimuli with `stim.pos += move`
+        if name == 'pos':
+            value = np.array(value, dtype=float)
+        object.__setattr__(self, name, value)
+
+    def draw(self, win=None):
+        pass
+
+TextStim = NullStim
+ShapeStim = NullStim
+ImageStim = NullStim
+
+class Sound():
+    def __init__(self, value=None, **kwargs):
+        self.value = value
+
+    def play(self, *args, **kwargs):
+        pass
+
+    def stop(self, *args, **kwargs):
+        pass
+
+    def getDuration(self):
+        return 0.0
+
+def runtime_info(window):
+    import psychopy
+
+    return {
+        'psychopyVersion': psychopy.__version__,
+        'systemHostName': socket.gethostname(),
+        'systemPlatform': '{} {}'.format(sys.platform, platform.release()),
+        'systemUserProcCount': 0,
+        'windowWinType': window.winType,
+        'windowSize_pix': list(window.size)
+    }
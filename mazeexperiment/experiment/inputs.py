@@ -0,0 +1,101 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function
+from psychopy import core, event
+
+from collections import deque, namedtuple
+
+# Window and response box input is collected in one place. The experiment
+# polls every source once per frame (and continuously while waiting for a
+# response); each event is offered to the registered handlers, newest first,
+# and a handler that returns True consumes it. Anything left over is kept
+# for response collection, so no collector can swallow another's input.
+
+POLL_INTERVAL = 0.001
+PENDING_EVENTS = 64
+
+# timestamp is on the core.getTime() clock; modifiers is None for sources
+# without modifier keys
+InputEvent = namedtuple('InputEvent', ['source', 'key', 'modifiers', 'timestamp'])
+
+def is_abort(input_event):
+    modifiers = input_event.modifiers or {}
+    return input_event.key == 'escape' and modifiers.get('ctrl') and modifiers.get('alt')
+
+def keyboard_events():
+    return [
+        InputEvent('keyboard', key, modifiers, timestamp)
+        for key, modifiers, timestamp in event.getKeys(modifiers=True, timeStamped=True)
+    ]
+
+class SRBoxEvents():
+    def __init__(self, srbox):
+        self.srbox = srbox
+        self.position = None
+
+    def __call__(self):
+        presses, self.position = self.srbox.read_presses(self.position)
+        return [
+            InputEvent('srbox', key, None, stamp)
+            for keys, stamp in presses for key in keys
+        ]
+
+class InputDispatcher():
+    def __init__(self):
+        self.sources = []
+        self.handlers = []
+        self.pending = deque(maxlen=PENDING_EVENTS)
+
+    def add_source(self, poll):
+        self.sources.append(poll)
+
+    def add_handler(self, handler):
+        if handler not in self.handlers:
+            self.handlers.append(handler)
+        return handler
+
+    def remove_handler(self, handler):
+        if handler in self.handlers:
+            self.handlers.remove(handler)
+
+    def poll(self):
+        for poll in self.sources:
+            for input_event in poll():
+                self.dispatch(input_event)
+
+    def dispatch(self, input_event):
+        for handler in reversed(self.handlers):
+            if handler(input_event):
+                return
+        self.pending.append(input_event)
+
+    def take(self, keys=None, source=None, since=None):
+        taken = []
+        kept = deque(maxlen=PENDING_EVENTS)
+        for input_event in self.pending:
+            if (keys is None or input_event.key in keys) \
+                    and (source is None or input_event.source == source):
+                if since is None or input_event.timestamp >= since:
+                    taken.append(input_event)
+                # Matching events from before `since` are stale either way
+                continue
+            kept.append(input_event)
+
+        self.pending = kept
+        return taken
+
+    def wait(self, keys=None, source=None, clock=None, max_wait=None):
+        # Events from before the clock was last reset (or before the wait, if
+        # there is no clock) are discarded; the clock's zero is the onset
+        now = core.getTime()
+        since = now if clock is None else now - clock.getTime()
+        deadline = None if max_wait is None else now + max_wait
+
+        while True:
+            self.poll()
+            taken = self.take(keys, source, since)
+            if taken:
+                return taken[0]
+            if deadline is not None and core.getTime() >= deadline:
+                return None
+            core.wait(POLL_INTERVAL, hogCPUperiod=0)
@@ -0,0 +1,171 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function
+from psychopy import logging
+
+import numpy as np
+
+import io
+import json
+import os
+
+# Bump whenever the timeline file format changes
+TIMELINE_VERSION = 2
+
+# The instruction sequence is described as data in instructions_timeline.json.
+# Compiling it expands the demonstrations and turns every wait into a frame
+# count, so each action lands on a fixed frame index. Random choices are drawn
+# from the timeline's seed, which makes every replay show the same frames.
+# Steps that change something (set, audio, lights, arrow) become actions;
+# wait (scaled by the speed multiplier), hold, move and label only advance or
+# mark the frame index.
+#
+# The wording itself stays in the instruction text files: a step names the
+# lines it shows (text_lines, each one a line on screen) or logs (en_lines),
+# and they are filled in when the timeline is loaded.
+
+ACTIONS = ('set', 'audio', 'lights', 'arrow')
+
+# (step field, lines field, separator the lines are joined with)
+TEXT_FIELDS = (
+    ('text', 'text_lines', u'\u2028'),
+    ('en', 'en_lines', u' ')
+)
+
+def read_lines(text_file):
+    with io.open(text_file, 'r', encoding='utf-8') as source:
+        return source.read().split(u'\n')
+
+def load_timeline(timeline_file):
+    with io.open(timeline_file, 'r', encoding='utf-8') as source:
+        timeline = json.load(source)
+
+    if timeline.get('version') != TIMELINE_VERSION:
+        raise ValueError(u'Unsupported instruction timeline version in {}'.format(timeline_file))
+
+    data_dir = os.path.dirname(timeline_file)
+    sources = dict(
+        (field, read_lines(os.path.join(data_dir, text_file)))
+        for field, text_file in timeline.get('text_files', {}).items()
+    )
+
+    for step in timeline['steps']:
+        for field, lines_field, separator in TEXT_FIELDS:
+            if lines_field not in step:
+                continue
+            # Line numbers count from 1, as in an editor
+            lines = sources[field]
+            numbers = step.pop(lines_field)
+            if not all(1 <= number <= len(lines) for number in numbers):
+                raise ValueError(u'Instruction timeline line out of range in {}: {}'.format(timeline_file, numbers))
+            step[field] = separator.join(lines[number - 1] for number in numbers)
+
+    return timeline
+
+def timeline_strings(timeline):
+    for step in timeline['steps']:
+        if 'text' in step:
+            yield step['text']
+        for pair in step.get('example', []):
+            for word in pair:
+                yield word
+
+def expand_steps(steps, random, frames):
+    for step in steps:
+        if 'blink_arrow' in step:
+            show = True
+            for i in range(step['count']):
+                yield {'arrow': step['blink_arrow'], 'show': show}
+                yield {'hold': step['interval']}
+                show = not show
+
+        elif 'example' in step:
+            low, high = (frames(duration) for duration in step['choice'])
+            for pair in step['example']:
+                side = 'left' if random.randint(0, 2) == 0 else 'right'
+                left, right = pair if side == 'left' else reversed(pair)
+
+                yield {'set': 'fixation', 'autoDraw': True}
+                yield {'hold': step['fixation']}
+                yield {'set': 'fixation', 'autoDraw': False}
+                yield {'set': 'text_left', 'text': left, 'autoDraw': True}
+                yield {'set': 'text_right', 'text': right, 'autoDraw': True}
+                yield {'frames': random.randint(low, high + 1)}
+                yield {'arrow': side, 'show': True}
+                yield {'lights': 'INDICATOR_L' if side == 'left' else 'INDICATOR_R', 'mode': 'blink'}
+                yield {'hold': step['response']}
+                yield {'arrow': side, 'show': False}
+                yield {'lights': 'ALL_OFF'}
+                yield {'set': 'text_left', 'autoDraw': False}
+                yield {'set': 'text_right', 'autoDraw': False}
+
+        else:
+            yield step
+
+class CompiledTimeline():
+    def __init__(self, timeline, frame_dur, speed=1.0):
+        frames = lambda duration: int(round(duration / frame_dur))
+        random = np.random.RandomState(timeline['seed'])
+
+        # (frame, action, step) in the order they are applied
+        self.actions = []
+        self.labels = {}
+        self.audio = []
+
+        frame = 0
+        for step in expand_steps(timeline['steps'], random, frames):
+            if 'wait' in step:
+                frame += frames(step['wait'] * speed)
+            elif 'hold' in step:
+                frame += frames(step['hold'])
+            elif 'frames' in step:
+                frame += step['frames']
+            elif 'label' in step:
+                self.labels[step['label']] = frame
+            elif 'move' in step:
+                count = frames(step['duration'])
+                start = np.array(step['from'], dtype=float)
+                move = (np.array(step['to'], dtype=float) - start) / count
+                for i in range(count):
+                    self.actions.append((frame, 'set', {'set': step['move'], 'pos': start + move * (i + 1)}))
+                    frame += 1
+            else:
+                action = [name for name in ACTIONS if name in step][0]
+                if action == 'audio':
+                    self.audio.append(step['audio'])
+                self.actions.append((frame, action, step))
+
+        self.length = frame
+
+class TimelinePlayer():
+    def __init__(self, compiled, handlers):
+        self.compiled = compiled
+        self.handlers = handlers
+
+        # Next frame to be shown and next action to be applied
+        self.frame = 0
+        self._next = 0
+
+    @property
+    def remaining(self):
+        return max(0, self.compiled.length - self.frame)
+
+    def advance(self, frame, audio=True):
+        # Apply every action up to and including `frame`; a dropped frame
+        # applies the actions it would have shown on the next one
+        actions = self.compiled.actions
+        while self._next < len(actions) and actions[self._next][0] <= frame:
+            at, action, step = actions[self._next]
+            if audio or action != 'audio':
+                self.handlers[action](step)
+            self._next += 1
+
+        self.frame = max(self.frame, frame + 1)
+
+    def seek(self, label):
+        # Jump ahead to a label: the screen ends up as it would have been
+        # there, without the narration in between
+        frame = self.compiled.labels[label]
+        if frame > self.frame:
+            self.advance(frame - 1, audio=False)
+            logging.exp(u'Instructions skipped to {}'.format(label))
@@ -14,14 +14,17 @@ from datetime import datetime
 import time
 import os, sys
 
-# Text constants
-TEXT_GET_READY = u'请准备'
-TEXT_FEEDBACK_CORRECT = u'正确！'
-TEXT_FEEDBACK_INCORRECT = u'错误！'
+from .responses import LEFT, RIGHT
+from .inputs import is_abort
+from .audio import InstructionAudio
+from .instructionplan import CompiledTimeline, TimelinePlayer, load_timeline
 
 # Speed constants
 SPEED_MULTIPLIER = 1.0
 
+# Response box lights blink on and off every 20 frames at 60 Hz (ms)
+BLINK_PERIOD = 667
+
 class Instructions():
     def __init__(self, parent, exp_info):
         logging.debug(u'Entered instructions class.')
@@ -37,455 +40,97 @@ class Instructions():
 
         self.srlight_status = {
             'active': [0,0,0,0,0],
-            'mode': 'solid',
-            'blink_frame': 0
+            'mode': 'solid'
         }
 
         self.debug_mode = True
+        self.audio = None
 
-    def begin_instructions(self):
-        self.prepare_visuals()
-        self.prepare_audio()
-        # self.paragraph.text = u'In this experiment, you will be asked to read sentences in Mandarin. '
-        self.play_instructions(1)
-        self.paragraph.text = (
-            u'在这个实验中，你将阅读一些中文句子。'
-        )
-        self.paragraph.autoDraw = True
-        self.paragraph.alignVert = 'center'
-        self.flipper(5 * SPEED_MULTIPLIER)
-
-        # self.paragraph.text = (
-        #     u'The words in each sentence will be presented one at a time. Each word ' +
-        #     u'in a sentence will appear beside an unrelated word that does ' +
-        #     u'that does not fit into the sentence.'
-        # )
-        self.play_instructions(2)
-        self.paragraph.text = (
-            u'句子中的词将会一个一个呈现。每一个适合语\u2028' +
-            u'境的词将会和一个不适合语境的词同时出现。'
-        )
-        self.flipper(10 * SPEED_MULTIPLIER)
-
-        # self.paragraph.text = (
-        #     u'Your task is to choose which word fits best into the sentence. '+
-        #     u'You will do this by pressing the button which corresponds to the side ' +
-        #     u'that the correct word is on.'
-        # )
-        self.play_instructions(3)
-        self.paragraph.text = (
-            u'你需要做的就是选出适合语境那个词。你将按相应的键\u2028' +
-            u'来选择正确的词。'
-        )
-        self.set_srlights('INDICATOR_BOTH', mode='blink')
-        self.flipper(10 * SPEED_MULTIPLIER)
-        self.set_srlights('ALL_OFF')
-
-        # self.paragraph.text = (
-        #     u'To choose the word that is on the left side of the screen, ' +
-        #     u'press the button that is on the left side of the response box.'
-        # )
-        self.play_instructions(4)
-        self.paragraph.text = u'如果要选择左边的词，按左键。'
-        self.flipper(3 * SPEED_MULTIPLIER)
-        draw = True
-        self.set_srlights('INDICATOR_L', mode='blink')
-        for i in range(20):
-            self.draw_left_arrow(draw)
-            self.flipper(0.25)
-            draw = not draw
-
-        self.set_srlights('ALL_OFF')
-        self.draw_left_arrow(False)
-        self.paragraph.autoDraw = False
-        self.flipper(1)
-
-        self.paragraph.autoDraw = True
-        # self.paragraph.text = (
-        #     u'To choose the word that is on the right side of the screen, ' +
-        #     u'press the button that is on the right side of the response box.'
-        # )
-        self.play_instructions(5)
-        self.paragraph.text = u'如果要选择右边的词，按右键。'
-        self.flipper(3 * SPEED_MULTIPLIER)
-        draw = True
-        self.set_srlights('INDICATOR_R', mode='blink')
-        for i in range(20):
-            self.draw_right_arrow(draw)
-            self.flipper(0.25)
-            draw = not draw
-
-        self.set_srlights('ALL_OFF')
-        self.draw_right_arrow(False)
-        self.flipper(0.5)
-
-        move, frames = self.animated_move([-0.8, 0.0], [-0.8, 0.75], 2)
-        for i in range(frames):
-            self.paragraph.pos += move
-            self.window.flip()
-
-        self.paragraph.autoDraw = False
-        self.paragraph.alignVert = 'top'
-        self.flipper(0.25)
-        # self.paragraph.text = (
-        #     u'Before each block of sentences begins, ' +
-        #     u'a message will appear on screen which states "GET READY"'
-        # )
-        self.play_instructions(6)
-        self.paragraph.text = u'每个句子开始之前，你会看到“请准备”的提示。'
-        self.paragraph.pos= (-0.8, 0.9)
-        self.paragraph.autoDraw = True
-        self.flipper(3 * SPEED_MULTIPLIER)
-
-        # self.message.text = u'GET READY'
-        self.message.text = TEXT_GET_READY
-        self.message.autoDraw = True
-        self.flipper(7.5 * SPEED_MULTIPLIER)
+        self.timeline = load_timeline(os.path.join(self.parent.pwd, u'data', u'instructions_timeline.json'))
 
-        self.paragraph.autoDraw = False
-        self.flipper(0.25)
-        # self.paragraph.text = (
-        #     u'This will be followed briefly by a blank screen. When a ' +
-        #     u'fixation cross (+) appears on screen, the first sentence is about '+
-        #     u'to begin. Here\'s an example:'
-        # )
-        self.play_instructions(7)
-        self.paragraph.text = (
-            u'紧跟着你会看到空白屏幕。然后“+” 会出现在屏幕上，\u2028' +
-            u'第一个句子即将开始。我们来看一个例子：'
-        )
-        self.paragraph.autoDraw = True
-        self.flipper(10 * SPEED_MULTIPLIER)
-        self.paragraph.autoDraw = False
-        self.flipper(2 * SPEED_MULTIPLIER)
-        self.message.autoDraw = False
-        self.flipper(1)
-        self.fixation.autoDraw = True
-        self.flipper(3 * SPEED_MULTIPLIER)
-
-        # self.paragraph.text = (
-        #     u'The first word in each sentence will be presented beside a series of X symbols.'
-        # )
-        self.play_instructions(8)
-        self.paragraph.text = (
-            u'你需要按相应的键选择正确的词。\u2028' +
-            u'每个句子的第一个词的选项里\u2028' +
-            u'只有一是词，你只需要选择这个词。'
-        )
-        self.paragraph.autoDraw = True
-        self.flipper(9 * SPEED_MULTIPLIER)
+    def begin_instructions(self, replay=False):
+        self.parent.inputs.add_handler(self.abort_handler)
+        self.prepare_visuals()
 
-        self.text_left.text = 'XXX'
-        # self.text_right.text = 'The'
-        self.text_right.text = u'一个'
-        self.text_left.autoDraw = True
-        self.text_right.autoDraw = True
-        self.flipper(0.5)
+        timeline = CompiledTimeline(self.timeline, self.parent.frame_dur, SPEED_MULTIPLIER)
+        self.prepare_audio(timeline.audio)
+        player = TimelinePlayer(timeline, {
+            'set': self.set_stim,
+            'audio': self.cue_audio,
+            'lights': self.cue_lights,
+            'arrow': self.cue_arrow
+        })
+
+        # A replay can be skipped to the replay or continue choice
+        self.skip_requested = False
+        if replay:
+            self.parent.inputs.add_handler(self.skip_handler)
+
+        self.play_timeline(player, until=lambda: self.skip_requested)
+        if self.skip_requested:
+            self.audio.stop()
+            player.seek(self.timeline['skip_to'])
+            self.play_timeline(player)
+        self.parent.inputs.remove_handler(self.skip_handler)
+
+        # Simulated sessions always continue rather than replaying at random
+        response = self.parent.response_device.wait_response(target_pos=RIGHT, forced=True)
 
-        self.fixation.autoDraw = False
-        self.flipper(3 * SPEED_MULTIPLIER)
-
-        # self.paragraph.text = (
-        #     u'You have to press the response button which corresponds to the correct word.'
-        # )
-        # This sentence has been combined with the above translation
-
-        # self.paragraph.autoDraw = True
-        # self.flipper(3 * SPEED_MULTIPLIER)
-
-        # self.paragraph.text = (
-        #     u'Press the button on the right to choose that word.'
-        # )
-        self.play_instructions(9)
-        self.paragraph.text = u'按左键选择左边的词。'
-        self.paragraph.pos = (-0.9, -0.6)
-
-        draw = True
-        self.set_srlights('INDICATOR_R', mode='blink')
-        for i in range(20):
-            self.draw_right_arrow(draw)
-            self.flipper(0.25)
-            draw = not draw
-
-        self.set_srlights('ALL_OFF')
-        self.draw_right_arrow(False)
-        self.flipper(0.5)
-
-        self.paragraph.autoDraw = True
-        self.paragraph.pos = (-0.8, 0.9)
-        # self.paragraph.text = (
-        #     u'After you choose a word, both words will be replaced by a fixation cross. ' +
-        #     u'Then, you will see two new words. Only one of these words can come after the ' +
-        #     u'previous word that you chose. Here\'s an example:'
-        # )
-        self.play_instructions(10)
-        self.paragraph.text = (
-            u'你做好选择之后，两个词会消失，“+”会出现。\u2028' +
-            u'然后你会看到两个新词，其中一个更接应\u2028' +
-            u'前一个被选择的词的语境。\u2028' +
-            u'我们来看一个例子：'
-        )
-        self.flipper(15 * SPEED_MULTIPLIER)
         self.text_left.autoDraw = False
         self.text_right.autoDraw = False
-        self.fixation.autoDraw = True
-        self.paragraph.autoDraw = False
-        self.flipper(0.5)
-
         self.fixation.autoDraw = False
-        # self.text_left.text = 'boy'
-        self.text_left.text = u'男孩'
-        # self.text_right.text = 'jumped'
-        self.text_right.text = u'跳'
-        self.text_left.autoDraw = True
-        self.text_right.autoDraw = True
-
-        self.flipper(3 * SPEED_MULTIPLIER)
-
-        self.paragraph.autoDraw = True
-        # self.paragraph.text = (
-        #     u'Now you should choose the word that is on the left side by pressing ' +
-        #     u'the button on the left. You would choose this because "The boy..." is ' +
-        #     u'correct grammar, while "The jumped..." is not a legal sentence.'
-        # )
-        self.play_instructions(11)
-        self.paragraph.text = u'按左键选择左边的词。\u2028因为“一个男孩” 是正确语法而“一个跳”不是。'
-        self.flipper(11 * SPEED_MULTIPLIER)
-
-        self.paragraph.pos = (-0.5, -0.6)
-        # self.paragraph.text = (
-        #     u'Press the button on the left to choose that word.'
-        # )
-        self.play_instructions(12)
-        self.paragraph.text = u'按左键选择左边的词。'
-
-        draw = True
-        self.set_srlights('INDICATOR_L', mode='blink')
-        for i in range(20):
-            self.draw_left_arrow(draw)
-            self.flipper(0.25)
-            draw = not draw
-
-        self.set_srlights('ALL_OFF')
-        self.draw_left_arrow(False)
-        self.text_left.autoDraw = False
-        self.text_right.autoDraw = False
-        self.paragraph.autoDraw = False
-        self.flipper(1.5)
-
-        # self.paragraph.text = (
-        #     u'Good! Now you will see an example of responses to an entire sentence. ' +
-        #     u'Please watch the screen carefully, but do not make any responses.'
-        # )
-        self.play_instructions(13)
-        self.paragraph.text = (
-            u'很好！\u2028现在我们来看一个完整' +
-            u'句子词汇选择的例子。\u2028' +
-            u'请认真观看，不需要做任何选择。'
-        )
-
-        self.paragraph.autoDraw = True
-        self.paragraph.pos = (-0.8, 0)
-        self.flipper(10 * SPEED_MULTIPLIER)
-
-        # example_sentence = [
-        #     [u"这种", u"ＸＸ"],
-        #     [u"人", u"峙"],
-        #     [u"用", u"肩"],
-        #     [u"这种", u"签订"],
-        #     [u"方法", u"温馨"],
-        #     [u"治", u"＃"],
-        #     [u",", u"*"],
-        #     [u"可谓", u"卑鄙"],
-        #     [u"是", u"韦"],
-        #     [u"以毒攻毒", u"无地自容"],
-        #     [u".", u"*"]
-        # ]
-        example_sentence = [
-            [u"她", u"Ｘ"],
-            [u"喜爱", u"日本"],
-            [u"她", u"住"],
-            [u"的", u"这"],
-            [u"小", u"在"],
-            [u"狗,", u"要,"],
-            [u"那", u"性"],
-            [u"小", u"院"],
-            [u"狗", u"还"],
-            [u"也", u"却"],
-            [u"诚然", u"人民"],
-            [u"可爱。", u"改革。"]
-        ]
-        self.paragraph.autoDraw = False
-        self.flipper(2 * SPEED_MULTIPLIER)
-
-        # self.message.text = u'GET READY'
-        self.message.text = TEXT_GET_READY
-        self.message.autoDraw = True
-        self.flipper(5 * SPEED_MULTIPLIER)
-        self.message.autoDraw = False
-        self.flipper(1)
-        self.fixation.autoDraw = True
-        self.flipper(3 * SPEED_MULTIPLIER)
-
-        for pair in example_sentence:
-            target_pos = randint(0,2)
-
-            self.fixation.autoDraw = True
-            self.flipper(0.2)
-            self.fixation.autoDraw = False
-
-            if target_pos == 0:
-                self.text_left.text = pair[0]
-                self.text_right.text = pair[1]
-            else:
-                self.text_left.text = pair[1]
-                self.text_right.text = pair[0]
-
-            self.text_left.autoDraw = True
-            self.text_right.autoDraw = True
-            self.flipper(randint(15,25)/20)
-
-            if target_pos == 0:
-                self.draw_left_arrow(True)
-                self.set_srlights('INDICATOR_L', mode='blink')
-                self.flipper(0.3)
-                self.draw_left_arrow(False)
-                self.set_srlights('ALL_OFF')
-            else:
-                self.draw_right_arrow(True)
-                self.set_srlights('INDICATOR_R', mode='blink')
-                self.flipper(0.3)
-                self.draw_right_arrow(False)
-                self.set_srlights('ALL_OFF')
-
-            self.text_left.autoDraw = False
-            self.text_right.autoDraw = False
-
-        self.paragraph.autoDraw = True
-        self.paragraph.pos = (-0.8, 0.9)
-        # self.paragraph.text = (
-        #     u'After you reach the end of the sentence, a feedback message will be displayed.'
-        # )
-        self.play_instructions(14)
-        self.paragraph.text = u'当你选好每个句子的最后一个词，\u2028你会看到一个反馈消息。'
-
-        # self.message.text = u'Correct!'
-        self.message.text = TEXT_FEEDBACK_CORRECT
-        self.message.color = (-1, 1, -1)
-        self.message.autoDraw = True
-
-        self.set_srlights('FEEDBACK_CORRECT', mode='blink')
-        self.flipper(5 * SPEED_MULTIPLIER)
-        self.set_srlights('ALL_OFF', mode='blink')
         self.message.autoDraw = False
+        self.paragraph.autoDraw = False
 
-        # self.paragraph.text = (
-        #     u'If you choose the wrong word in the middle of a sentence, the trial will end:'
-        # )
-        self.play_instructions(15)
-        self.paragraph.text = (
-            u'如果你在句中选择了错误的词，\u2028' +
-            u'这个句子会半途而废：\u2028' +
-            u'然后你会看到 “错误！” 的提示。'
-        )
-        self.flipper(7 * SPEED_MULTIPLIER)
-
-        self.fixation.autoDraw = True
-        self.flipper(0.5)
-        self.fixation.autoDraw = False
-
-        # self.text_left.font = 'Times New Roman'
-        # self.text_right.font = 'Times New Roman'
-        self.text_left.text = u'✔✔✔'
-        self.text_right.text = u'✘✘✘'
-        self.text_left.autoDraw = True
-        self.text_right.autoDraw = True
-        self.flipper(3)
-
-        self.draw_right_arrow(True)
-        self.set_srlights('INDICATOR_R')
-        self.flipper(1)
-        self.set_srlights('ALL_OFF')
-        self.draw_right_arrow(False)
-
-        self.text_left.autoDraw = False
-        self.text_right.autoDraw = False
-        # self.text_left.font = 'MingLiU'
-        # self.text_right.font = 'MingLiU'
-        self.window.color = (1, -1, -1)
-        self.flipper(0.2)
-        self.window.color = (1, 1, 1)
-
-        self.fixation.autoDraw = True
-        self.flipper(0.5)
-        self.fixation.autoDraw = False
+        self.parent.inputs.remove_handler(self.abort_handler)
+        self.abort_instructions()
+        if response.side == LEFT:
+            self.begin_instructions(replay=True)
+        elif response.side == RIGHT:
+            return
 
-        # self.message.text = u'Incorrect'
-        self.message.text = TEXT_FEEDBACK_INCORRECT
-        self.message.color = (1, -1, -1)
-        self.message.autoDraw = True
-        self.set_srlights('FEEDBACK_INCORRECT', mode='blink')
+    def play_timeline(self, player, until=None):
+        scheduler = self.parent.scheduler
+        origin = []
 
-        self.flipper(5 * SPEED_MULTIPLIER)
+        def draw():
+            # Timeline frames follow the scheduler's frame counter, so a
+            # dropped frame does not delay anything after it
+            if not origin:
+                origin.append(scheduler.frame + 1 - player.frame)
+            player.advance(scheduler.frame + 1 - origin[0])
+            self.audio.update()
 
-        self.message.autoDraw = False
-        self.set_srlights('ALL_OFF')
-
-        self.paragraph.autoDraw = True
-        self.paragraph.pos = (-0.8, 0)
-
-        # self.paragraph.text = (
-        #     u'If you have any questions about this experiment, please ask the experimenter now. '
-        # )
-        self.play_instructions(16)
-        self.paragraph.text = u'如果你有任何问题，请现在提问。'
-        self.flipper(5 * SPEED_MULTIPLIER)
-
-        move, frames = self.animated_move([-0.8, 0.0], [-0.8, 0.75], 5)
-        for i in range(frames):
-            self.paragraph.pos += move
-            self.window.flip()
-
-        # self.paragraph.text = (
-        #     u'If you would like to see these instructions again, press the button on the left. ' +
-        #     u'If you are ready to try a few practice trials, press the button on the right.'
-        # )
-        self.play_instructions(17)
-        self.paragraph.text = (
-            u'如果你还需要看一遍实验介绍，按左键。\u2028' +
-            u'如果你没有问题已经准备好，按右键。'
+        scheduler.present(
+            'instructions', player.remaining, draw=draw, until=until, timed=False
         )
+        if not (until is not None and until()):
+            player.advance(player.compiled.length)
 
-        self.text_left.height = 0.12
-        self.text_right.height = 0.12
+    def set_stim(self, step):
+        stim = getattr(self, step['set'])
+        for attribute, value in step.items():
+            if attribute != 'set':
+                setattr(stim, attribute, value)
 
-        # self.text_left.text = u'↺ Replay'
-        self.text_left.text = u'↺ 重放实验介绍'
-        # self.text_right.text = u'Continue ➡'
-        self.text_right.text = u'继续到实验 ➡'
-        self.fixation.text = u'|'
-        self.text_left.autoDraw = True
-        self.text_right.autoDraw = True
-        self.fixation.autoDraw = True
+    def cue_audio(self, step):
+        logging.exp(u'Instructions: {}'.format(step.get('en', step['audio'])))
+        self.play_instructions(step['audio'], wait=False)
 
-        self.flipper(1 * SPEED_MULTIPLIER)
+    def cue_lights(self, step):
+        self.set_srlights(step['lights'], mode=step.get('mode', 'solid'))
 
-        # self.flipper(12 * SPEED_MULTIPLIER)
-        if self.use_srbox:
-            response = self.srbox.waitKeys(keyList=[1, 5])[0]
+    def cue_arrow(self, step):
+        if step['arrow'] == 'left':
+            self.draw_left_arrow(step['show'])
         else:
-            response = event.waitKeys(keyList=['c', 'm'])[0]
-
-        self.text_left.autoDraw = False
-        self.text_right.autoDraw = False
-        self.fixation.autoDraw = False
-        self.message.autoDraw = False
-        self.paragraph.autoDraw = False
+            self.draw_right_arrow(step['show'])
 
-        if response in ('c', 1):
-            self.begin_instructions()
-        elif response in ('m', 5):
-            return
+    def skip_handler(self, input_event):
+        if input_event.key in self.timeline['skip_keys']:
+            self.skip_requested = True
+            return True
+        return False
 
     def _debug_srlight_state(self, state):
         if self.debug_mode:
@@ -497,16 +142,12 @@ class Instructions():
             print('\t\tSetting:\t{}'.format(which))
             print('\t\tMode:\t{}'.format(self.srlight_status['mode']))
 
-    def _srlights_off(self):
-        if self.use_srbox:
-            self.srbox.set_lights([0,0,0,0,0], update=True)
-
-        # self._debug_srlight_state([0,0,0,0,0])
-
-
     def _srlights_on(self):
         if self.use_srbox:
-            self.srbox.set_lights(self.srlight_status['active'], update=True)
+            if self.srlight_status['mode'] == 'blink':
+                self.srbox.lights.blink(self.srlight_status['active'], BLINK_PERIOD)
+            else:
+                self.srbox.lights.solid(self.srlight_status['active'])
 
         # self._debug_srlight_state(self.srlight_status['active'])
 
@@ -514,8 +155,6 @@ class Instructions():
         if not self.use_srbox and not self.debug_mode:
             return
 
-        self.srlight_status['blink_frame'] = 0
-
         if which == 'ALL_ON':
             self.srlight_status['active'] = [1,1,1,1,1]
             self.srlight_status['mode'] = 'solid'
@@ -544,44 +183,36 @@ class Instructions():
         self._srlights_on()
 
 
-    def prepare_audio(self):
+    def prepare_audio(self, clips):
         logging.debug(u'Preparing audio for playback...')
-        self.instructions_audio = {}
-
-        for i in range(1, 18):
-            logging.debug(u'Loading audio file instr_{:0>2}.wav...'.format(i))
-            self.instructions_audio[i] = sound.Sound(u'{}{}{}{}{}{}{}{}{}'.format(
-                self.parent.pwd, os.sep,
-                u'data', os.sep, u'instructions_audio',
-                os.sep, u'edited', os.sep, u'instr_{:0>2}.wav'.format(i)
-            ))
-            logging.debug(u'Loaded audio file instr_{:0>2}.wav.'.format(i))
-
-        self.current_audio = False
-
-    def play_instructions(self, i):
-        try:
-            self.instructions_audio[i].play()
-            self.current_audio = self.instructions_audio[i]
-        except KeyError:
-            return
+        if getattr(self, 'audio', None) is not None:
+            self.audio.close()
+
+        clip_files = {}
+        for i in clips:
+            clip_files[i] = os.path.join(self.parent.pwd, u'data', *self.timeline['audio'].format(i).split('/'))
+
+        # Clips are decoded in the background shortly before they are needed;
+        # only the first ones are waited for before the timeline starts.
+        # Headless sessions skip decoding altogether
+        self.audio = InstructionAudio(
+            self.parent.sound.Sound, clip_files, os.path.join(self.parent.pwd, u'data', u'cache', u'audio'),
+            decode=not self.parent.headless
+        )
+        self.audio.preload(clips[:self.audio.lookahead])
 
+    def play_instructions(self, i, wait=True):
+        self.audio.play(i, wait)
 
     def abort_instructions(self):
-        try:
-            for key in self.instructions_audio.keys():
-                self.instructions_audio[key].stop()
-                del self.instructions_audio[key]
-        except:
-            pass
+        if getattr(self, 'audio', None) is not None:
+            self.audio.close()
+            self.audio = None
 
     def prepare_visuals(self):
-        if 'darwin' in self.exp_info['platform']:
-            CHINESE_FONT = 'STFangSong'
-        elif 'win' in self.exp_info['platform']:
-            CHINESE_FONT = 'FangSong'
+        CHINESE_FONT = self.parent.chinese_font
 
-        self.paragraph = visual.TextStim(
+        self.paragraph = self.parent.visual.TextStim(
             win=self.window,  name='paragraph_text',text='',
             font=CHINESE_FONT, pos=(-0.8, 0),         height=0.1,
             wrapWidth=1.6,    color=(-1,-1,-1),   colorSpace='rgb',
@@ -589,21 +220,21 @@ class Instructions():
             alignHoriz='left', alignVert='top'
         )
 
-        self.left_arrow = visual.ShapeStim(
+        self.left_arrow = self.parent.visual.ShapeStim(
             win=self.window, name='left_arrow',
             lineColor=None, fillColor=(-1,-1,-1),
             vertices=[(-0.4,0.05),(-0.4,-0.05),(-.2,-0.05),(-.2,-0.1),(-0.1,0),(-.2,0.1),(-.2,0.05)],
             pos=(-1,-1), interpolate=True, ori=135
         )
 
-        self.right_arrow = visual.ShapeStim(
+        self.right_arrow = self.parent.visual.ShapeStim(
             win=self.window, name='right_arrow',
             lineColor=None, fillColor=(-1,-1,-1),
             vertices=[(-0.4,0.05),(-0.4,-0.05),(-.2,-0.05),(-.2,-0.1),(-0.1,0),(-.2,0.1),(-.2,0.05)],
             pos=(1,-1), interpolate=True, ori=45
         )
 
-        self.press_button_left = visual.ImageStim(
+        self.press_button_left = self.parent.visual.ImageStim(
             win=self.window, name='press_img_left',
             image=u'{}{}{}{}{}'.format(
                 self.parent.pwd, os.sep,
@@ -613,7 +244,7 @@ class Instructions():
             interpolate=True, pos=(-0.65, -0.55), flipHoriz=True
         )
 
-        self.press_button_right = visual.ImageStim(
+        self.press_button_right = self.parent.visual.ImageStim(
             win=self.window, name='press_img_right',
             image=u'{}{}{}{}{}'.format(
                 self.parent.pwd, os.sep,
@@ -623,21 +254,21 @@ class Instructions():
             interpolate=True, pos=(0.65, -0.55)
         )
 
-        self.message = visual.TextStim(
+        self.message = self.parent.visual.TextStim(
             win=self.window,    name='message', text='',
             font=CHINESE_FONT, pos=(0, 0),         height=0.25,
             wrapWidth=None,     color=(-1,-1,-1),   colorSpace='rgb',
             opacity=1,          depth=0.0,          ori=0
         )
 
-        self.fixation = visual.TextStim(
+        self.fixation = self.parent.visual.TextStim(
             win=self.window,    name='fixation',    text='+',
             font='Courier New', pos=(0, 0),         height=0.25,
             wrapWidth=None,     color=(-1, -1, -1), colorSpace='rgb',
             opacity=1,          depth=0.0,          ori=0
         )
 
-        self.text_left = visual.TextStim(
+        self.text_left = self.parent.visual.TextStim(
             win=self.window,    name='text_left',   text='',
             font=CHINESE_FONT,   pos=(-0.1, 0),      height=0.25,
             wrapWidth=None,     color=(-1, -1, -1), colorSpace='rgb',
@@ -645,7 +276,7 @@ class Instructions():
             alignHoriz='right'
         )
 
-        self.text_right = visual.TextStim(
+        self.text_right = self.parent.visual.TextStim(
             win=self.window,    name='text_right',  text='',
             font=CHINESE_FONT,   pos=(0.1, 0),       height=0.25,
             wrapWidth=None,     color=(-1, -1, -1), colorSpace='rgb',
@@ -664,34 +295,14 @@ class Instructions():
         self.right_arrow.autoDraw = draw
         self.press_button_right.autoDraw = draw
 
-    def flipper(self, time):
-        frames = int(round(time / self.parent.frame_dur))
-        for i in range(frames):
-            self.check_abort()
-            self.window.flip()
-            if (self.use_srbox or self.debug_mode) and self.srlight_status['mode'] == 'blink':
-                self.srlight_status['blink_frame'] += 1
-                if self.srlight_status['blink_frame'] % 40 == 0:
-                    self._srlights_on()
-                elif self.srlight_status['blink_frame'] % 20 == 0:
-                    self._srlights_off()
-
-    def check_abort(self):
-        keys = event.getKeys(keyList=['escape'], modifiers=True)
-        if keys and (keys[0][0] == 'escape' and keys[0][1]['ctrl'] and keys[0][1]['alt']):
+    def abort_handler(self, input_event):
+        # Only stops the audio; the event is left for the experiment's abort
+        if is_abort(input_event):
             try:
                 self.abort_instructions()
-            except:
+            except Exception:
                 pass
-
-            self.parent.abort()
-
-    def animated_move(self, start, end, duration):
-        frames = int(round(duration / self.parent.frame_dur))
-        move_x = (end[0] - start[0])/frames
-        move_y = (end[1] - start[1])/frames
-
-        return [move_x, move_y], frames
+        return False
 
     # def _rotate(self, vertices, rotation):
     #     rotated = []
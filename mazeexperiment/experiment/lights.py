@@ -0,0 +1,114 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function
+from psychopy import core
+
+from threading import Thread
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+# Response box lights are driven by their own thread, so neither the render
+# loop nor the caller ever waits on a serial write. A pattern is a list of
+# (lights, milliseconds) steps; a step held for None lasts until the next
+# command. A new command replaces the running pattern at once, and when
+# several are queued only the newest is played. The port is only written
+# when the lights actually change.
+
+LIGHT_COUNT = 5
+ALL_OFF = (0,) * LIGHT_COUNT
+
+def _lights(lights):
+    return tuple(int(bool(light)) for light in lights)
+
+class LightController():
+    def __init__(self, write):
+        self._write = write
+        self._written = None
+        self._commands = queue.Queue()
+        self._thread = Thread(target=self._run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def solid(self, lights):
+        self.play([(lights, None)])
+
+    def off(self):
+        self.solid(ALL_OFF)
+
+    def blink(self, lights, period, duration=None):
+        self.play([(lights, period / 2), (ALL_OFF, period / 2)], repeat=True, duration=duration)
+
+    def sequence(self, steps, repeat=False):
+        self.play(steps, repeat=repeat)
+
+    def play(self, steps, repeat=False, duration=None):
+        steps = [(_lights(lights), hold) for lights, hold in steps]
+        self._commands.put((steps, repeat, duration))
+
+    def close(self):
+        self._commands.put(None)
+        self._thread.join()
+
+    def _show(self, lights):
+        if lights != self._written:
+            self._write(list(lights))
+            self._written = lights
+
+    def _next_command(self, timeout):
+        try:
+            command = self._commands.get(timeout=timeout)
+        except queue.Empty:
+            return False
+
+        while True:
+            try:
+                command = self._commands.get_nowait()
+            except queue.Empty:
+                return command
+
+    def _run(self):
+        steps, repeat, deadline = [(ALL_OFF, None)], False, None
+        index = 0
+        step_end = None
+
+        while True:
+            lights, hold = steps[index]
+            self._show(lights)
+
+            now = core.getTime()
+            if hold is not None and step_end is None:
+                step_end = now + hold / 1000
+            ends = [end for end in (step_end, deadline) if end is not None]
+            timeout = max(0, min(ends) - now) if ends else None
+
+            command = self._next_command(timeout)
+            if command is None:
+                self._show(ALL_OFF)
+                return
+
+            if command is not False:
+                steps, repeat, duration = command
+                deadline = None if duration is None else core.getTime() + duration / 1000
+                index = 0
+                step_end = None
+                continue
+
+            now = core.getTime()
+            if deadline is not None and now >= deadline:
+                steps, repeat, deadline = [(ALL_OFF, None)], False, None
+                index = 0
+                step_end = None
+            elif step_end is not None and now >= step_end:
+                # Later steps are timed from when the previous one was due to
+                # end, so a late wake-up does not stretch the pattern
+                index += 1
+                if index == len(steps):
+                    if not repeat:
+                        steps = [(steps[-1][0], None)]
+                    index = 0
+
+                hold = steps[index][1]
+                step_end = None if hold is None else step_end + hold / 1000
@@ -0,0 +1,97 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function
+from psychopy import logging
+
+from threading import Thread
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+def enabled(level):
+    return level >= getattr(logging.root, 'lowestTarget', 0)
+
+def log(level, message, *args):
+    # Hot-path logging: the message is only formatted if some target wants it
+    if enabled(level):
+        logging.log(message.format(*args) if args else message, level)
+
+def log_on_flip(window, level, message, *args, **kwargs):
+    if enabled(level):
+        window.logOnFlip(message.format(*args) if args else message, level, kwargs.get('obj'))
+
+class AsyncLogFile():
+    # A PsychoPy logging target that never touches the disk on the calling
+    # thread. logging.flush() formats the pending entries and hands them to
+    # write(); flush() passes that batch to the writer thread.
+    def __init__(self, f, level=logging.DEBUG, filemode='a', encoding='utf-8', logger=None):
+        self.filename = f
+        self.level = level
+        self.encoding = encoding
+        self.stream = self
+
+        self._batch = []
+        self._closed = False
+        self._file = open(f, filemode + 'b')
+        self._queue = queue.Queue()
+        self._writer_thread = Thread(target=self._writer)
+        self._writer_thread.daemon = True
+        self._writer_thread.start()
+
+        self.logger = logging.root if logger is None else logger
+        self.logger.addTarget(self)
+
+    def setLevel(self, level):
+        self.level = level
+        self.logger.lowestTarget = min(target.level for target in self.logger.targets)
+
+    def write(self, txt):
+        if not isinstance(txt, bytes):
+            txt = txt.encode(self.encoding)
+        self._batch.append(txt)
+
+    def flush(self):
+        if not self._batch:
+            return
+
+        batch, self._batch = self._batch, []
+        if self._closed:
+            # Anything logged after close() (e.g. at exit) is written directly
+            with open(self.filename, 'ab') as log_file:
+                log_file.write(b''.join(batch))
+        else:
+            self._queue.put(batch)
+
+    def close(self):
+        if self._closed:
+            return
+
+        logging.flush()
+        self.flush()
+        self._closed = True
+        self._queue.put(None)
+        self._writer_thread.join()
+
+    def _writer(self):
+        while True:
+            batch = self._queue.get()
+            if batch is None:
+                self._file.close()
+                return
+
+            # Gather everything queued since the last wakeup into one write
+            batches = [batch]
+            try:
+                while True:
+                    batch = self._queue.get_nowait()
+                    if batch is None:
+                        self._queue.put(None)
+                        break
+                    batches.append(batch)
+            except queue.Empty:
+                pass
+
+            self._file.write(b''.join(b''.join(batch) for batch in batches))
+            self._file.flush()
@@ -0,0 +1,156 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function
+from psychopy import logging
+
+from contextlib import contextmanager
+import errno
+import io
+import json
+import os
+import time
+
+# Bump whenever the index file format changes
+INDEX_VERSION = 1
+
+# Participant numbers from here on are test sessions and are never suggested
+TEST_PARTICIPANTS = 500
+FIRST_PARTICIPANT = 101
+
+# Launches on shared storage take turns through an exclusive lock file; one
+# older than STALE_LOCK seconds was left behind by a launch that crashed
+LOCK_TIMEOUT = 10
+STALE_LOCK = 60
+LOCK_RETRY = 0.05
+
+# Allocated participant numbers are kept in a small index next to the data
+# files instead of being recovered from every file name on each launch. A
+# number is allocated when a session starts, under the lock, and the index is
+# replaced in one rename. A missing or unreadable index is rebuilt from the
+# data file names the same way they used to be read.
+
+def scan_participants(data_dir, exp_name):
+    data_file_base = u'{}_'.format(exp_name)
+    existing = set()
+    for dirname, dirnames, filenames in os.walk(data_dir):
+        for filename in filenames:
+            if data_file_base in filename and filename.endswith('.csv'):
+                existing.add(int(filename.split('_')[1]))
+
+    return existing
+
+def next_participant(allocated):
+    regular = [x for x in allocated if x < TEST_PARTICIPANTS]
+    return max(regular) + 1 if regular else FIRST_PARTICIPANT
+
+class ParticipantIndex():
+    def __init__(self, data_dir, exp_name):
+        self.data_dir = data_dir
+        self.exp_name = exp_name
+        self.index_file = os.path.join(data_dir, u'participants_{}.json'.format(exp_name))
+        self.lock_file = self.index_file + u'.lock'
+
+        self.allocated = set()
+        self.suggestion = FIRST_PARTICIPANT
+        if not self.load():
+            self.rebuild()
+
+    def __contains__(self, participant):
+        return participant in self.allocated
+
+    def load(self):
+        try:
+            with io.open(self.index_file, 'r', encoding='utf-8') as index:
+                contents = json.load(index)
+        except (IOError, OSError, ValueError):
+            return False
+
+        if contents.get('version') != INDEX_VERSION:
+            return False
+
+        self.allocated = set(contents['allocated'])
+        self.suggestion = contents['next']
+        return True
+
+    def rebuild(self):
+        with self._locked():
+            self.allocated = scan_participants(self.data_dir, self.exp_name)
+            self.suggestion = next_participant(self.allocated)
+            self._save()
+
+        logging.info(u'Rebuilt participant index with {} participants'.format(len(self.allocated)))
+
+    def next_free(self, participant):
+        while participant in self.allocated:
+            participant += 1
+        return participant
+
+    def allocate(self, participant):
+        # True if the number was free; another launch may have taken it since
+        # the index was read, so it is checked again under the lock
+        with self._locked():
+            if not self.load():
+                self.allocated = scan_participants(self.data_dir, self.exp_name)
+                self.suggestion = next_participant(self.allocated)
+
+            if participant in self.allocated:
+                return False
+
+            self.allocated.add(participant)
+            if participant < TEST_PARTICIPANTS:
+                self.suggestion = max(self.suggestion, participant + 1)
+            self._save()
+
+        return True
+
+    def _save(self):
+        text = json.dumps({
+            'version': INDEX_VERSION,
+            'next': self.suggestion,
+            'allocated': sorted(self.allocated)
+        })
+        if isinstance(text, bytes):
+            text = text.decode('utf-8')
+
+        temp_file = u'{}.{}.tmp'.format(self.index_file, os.getpid())
+        with io.open(temp_file, 'w', encoding='utf-8') as index:
+            index.write(text)
+
+        try:
+            os.rename(temp_file, self.index_file)
+        except OSError:
+            # Windows will not rename over an existing file
+            os.remove(self.index_file)
+            os.rename(temp_file, self.index_file)
+
+    @contextmanager
+    def _locked(self):
+        if not os.path.isdir(self.data_dir):
+            os.makedirs(self.data_dir)
+
+        deadline = time.time() + LOCK_TIMEOUT
+        while True:
+            try:
+                lock = os.open(self.lock_file, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+                break
+            except OSError as error:
+                if error.errno != errno.EEXIST:
+                    raise
+
+            try:
+                if time.time() - os.path.getmtime(self.lock_file) > STALE_LOCK:
+                    os.remove(self.lock_file)
+                    continue
+            except OSError:
+                continue
+
+            if time.time() > deadline:
+                raise RuntimeError(u'Could not lock participant index {}'.format(self.index_file))
+            time.sleep(LOCK_RETRY)
+
+        try:
+            os.write(lock, u'{}'.format(os.getpid()).encode('ascii'))
+            os.close(lock)
+            yield
+        finally:
+            os.remove(self.lock_file)
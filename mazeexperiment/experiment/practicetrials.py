@@ -12,6 +12,8 @@ from datetime import datetime
 import time
 import os, sys
 
+from .logsink import log_on_flip
+
 TEXT_GET_READY = u'请准备'
 TEXT_FEEDBACK_CORRECT = u'正确！'
 TEXT_FEEDBACK_INCORRECT = u'错误！'
@@ -35,11 +37,7 @@ class PracticeBlock():
 
         self.window = self.parent.window
 
-        self.use_srbox = self.parent.use_srbox
-        if self.use_srbox:
-            self.srbox = self.parent.srbox
-
-        self.block_clock = core.Clock()
+        self.block_clock = self.parent.new_clock()
 
         self.trials = data.TrialHandler(
             nReps=1, method='sequential', extraInfo=self.exp_info,
@@ -54,12 +52,9 @@ class PracticeBlock():
         self.parent.message.color = (-1, -1, -1)
         self.parent.message.draw()
 
-        self.window.flip()
+        self.parent.flip()
 
-        if self.use_srbox:
-            response = self.srbox.waitKeys(keyList=[1, 2, 3, 4, 5])[0]
-        else:
-            response = event.waitKeys()[0]
+        self.parent.response_device.wait_any()
 
         return
 
@@ -75,7 +70,7 @@ class PracticeBlock():
             )
             trial_pairs = dict(trial)
 
-            failed_trial = practice_trial.begin_trial()
+            failed_trial = self.run_trial(practice_trial)
 
             while not failed_trial:
                 attempt += 1
@@ -86,7 +81,17 @@ class PracticeBlock():
                 practice_trial = PracticeTrial(
                     self.parent, self.experiment, self.exp_info, trial, self.autorun, attempt
                 )
-                failed_trial = practice_trial.begin_trial()
+                failed_trial = self.run_trial(practice_trial)
+
+            self.parent.data_stream.sync()
+            self.parent.flush_logs()
+
+    def run_trial(self, practice_trial):
+        # Every attempt is timed on its own, from a clean frame timer
+        self.parent.frame_timer.reset()
+        result = practice_trial.begin_trial()
+        self.parent.frame_timer.end_trial()
+        return result
 
 class PracticeTrial():
     def __init__(self, parent, experiment, exp_info, trial, autorun=False, attempt=None):
@@ -114,11 +119,7 @@ class PracticeTrial():
         self.text_right = self.parent.text_right
         self.acc_feedback = self.parent.acc_feedback
 
-        self.use_srbox = self.parent.use_srbox
-        if self.use_srbox:
-            self.srbox = self.parent.srbox
-
-        self.sentence_progress = visual.TextStim(
+        self.sentence_progress = self.parent.visual.TextStim(
             win=self.window,    name='message', text='',
             font='SimSun', pos=(-0.9, 0.75),         height=0.10,
             wrapWidth=1.8,     color=(-1,-1,-1),   colorSpace='rgb',
@@ -127,8 +128,8 @@ class PracticeTrial():
         )
         self.progress_list = []
 
-        self.trial_clock = core.Clock()
-        self.pair_clock = core.Clock()
+        self.trial_clock = self.parent.new_clock()
+        self.pair_clock = self.parent.new_clock()
 
         self.trial = data.TrialHandler(
             nReps=1, method='sequential', extraInfo=self.exp_info,
@@ -160,7 +161,7 @@ class PracticeTrial():
 
             acc = 0
             while acc == 0:
-                self.show_fixation(0.2*SPEED_MULTIPLIER)
+                self.show_fixation(0.2*SPEED_MULTIPLIER, 'pair_fixation')
                 self.show_pair(pair, target_pos)
                 self.pair_clock.reset()
                 acc, response_time, response = self.get_response(target_pos)
@@ -181,7 +182,7 @@ class PracticeTrial():
             self.clear_pair()
             self.update_progress(pair['pair_correct'])
 
-            self.parent.experiment.nextEntry()
+            self.parent.next_entry()
 
         self.window.color = (-1, 1, -1)
         self.parent.display_message(TEXT_FEEDBACK_CORRECT, time=2*SPEED_MULTIPLIER)
@@ -322,35 +323,17 @@ class PracticeTrial():
 
     def get_response(self, target_pos):
         logging.debug(u'Waiting for practice trial response')
-        if self.autorun:
-            logging.exp(u'Autorun active. Sending automatic response...')
-            auto_response_time = 0.5 + random()
-            if randint(0,100) < 98:
-                return 1, auto_response_time, target_pos
-            else:
-                return 0, auto_response_time, int(not target_pos)
-
-        if self.use_srbox:
-            response, response_time = self.srbox.waitKeys(keyList=[1, 5], timeStamped=self.pair_clock)
-            response = response[0]
-        else:
-            response, response_time = event.waitKeys(keyList=['c', 'm'], timeStamped=self.pair_clock)[0]
-
-        if response in ('c', 1):
-            response = 0
-        elif response in ('m', 5):
-            response = 1
+        response = self.parent.response_device.wait_response(self.pair_clock, target_pos)
+        self.parent.scheduler.resync()
 
-        if response == target_pos:
-            return 1, response_time, response
+        if response.side == target_pos:
+            return 1, response.rt, response.side
         else:
-            return 0, response_time, response
+            return 0, response.rt, response.side
 
     def flip(self, count=1):
         # self.sentence_progress.draw()
-        for i in range(int(count)):
-            self.check_abort()
-            self.window.flip()
+        self.parent.scheduler.present('practice', int(count), timed=False)
 
     # def check_abort(self):
     #     keys = event.getKeys(keyList=['escape'], modifiers=True)
@@ -362,35 +345,22 @@ class PracticeTrial():
     #             pass
     #         core.quit()
 
-    def show_fixation(self, time):
-        frames = int(round(time / self.parent.frame_dur))
-        self.window.logOnFlip(
-            'Begin show fixation for {:.2f} ({} frames/{} actual est.)'.format(time, frames, (frames*self.parent.frame_dur)),
-            logging.EXP
+    def show_fixation(self, time, phase='fixation'):
+        frames = self.parent.scheduler.frames(time)
+        log_on_flip(
+            self.window, logging.EXP,
+            'Begin show fixation for {:.2f} ({} frames/{} actual est.)', time, frames, (frames*self.parent.frame_dur)
         )
-        for i in range(frames):
-            self.parent.fixation.draw()
-            self.flip()
+        self.parent.scheduler.present(phase, frames, draw=self.parent.fixation.draw)
 
         self.window.logOnFlip(u'End show fixation', logging.EXP)
 
     def show_blank(self, time):
-        frames = int(round(time / self.parent.frame_dur))
-        self.window.logOnFlip(
-            'Begin show blank screen for {:.2f} ({} frames/{} actual est.)'.format(time, frames, (frames*self.parent.frame_dur)),
-            logging.EXP
+        frames = self.parent.scheduler.frames(time)
+        log_on_flip(
+            self.window, logging.EXP,
+            'Begin show blank screen for {:.2f} ({} frames/{} actual est.)', time, frames, (frames*self.parent.frame_dur)
         )
-        for i in range(frames):
-            self.flip()
+        self.parent.scheduler.present('blank', frames)
 
         self.window.logOnFlip(u'End show blank screen', logging.EXP)
-
-    def check_abort(self):
-        keys = event.getKeys(keyList=['escape'], modifiers=True)
-        if keys and (keys[0][0] == 'escape' and keys[0][1]['ctrl'] and keys[0][1]['alt']):
-            self.experiment.saveAsWideText('{}.csv'.format(self.parent.data_file_stem))
-            logging.flush()
-            # make sure everything is closed down
-            self.experiment.abort()
-            self.window.close()
-            core.quit()
@@ -0,0 +1,127 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function
+from psychopy import core, event, logging
+
+import numpy as np
+from abc import ABCMeta, abstractmethod
+from collections import namedtuple
+
+LEFT = 0
+RIGHT = 1
+
+# side is LEFT/RIGHT (None for keys that are not mapped to a side), rt is in
+# seconds on the clock passed in (from the start of the wait without one) and
+# timestamp is on the core.getTime() clock
+Response = namedtuple('Response', ['side', 'key', 'rt', 'timestamp', 'device'])
+
+# Works as an abstract base on both Python 2 and 3, so a device missing one
+# of the methods fails when it is created rather than during a session
+_AbstractDevice = ABCMeta('_AbstractDevice', (object,), {})
+
+class ResponseDevice(_AbstractDevice):
+    name = 'device'
+    side_keys = {}
+
+    @abstractmethod
+    def wait_response(self, clock=None, target_pos=None, forced=False):
+        # forced: a prompt with only one expected answer, which simulated
+        # devices always give
+        pass
+
+    @abstractmethod
+    def wait_any(self):
+        pass
+
+class InputDevice(ResponseDevice):
+    # Responses are collected from the experiment's InputDispatcher, so the
+    # abort hotkey and other handlers still see every event during the wait
+    source = None
+    any_keys = None
+
+    def __init__(self, inputs):
+        self.inputs = inputs
+
+    def _wait(self, keys, clock):
+        # Without a clock only events from after the start of the wait count
+        start = core.getTime()
+        input_event = self.inputs.wait(keys=keys, source=self.source, clock=clock)
+        if clock is None:
+            rt = input_event.timestamp - start
+        else:
+            rt = clock.getTime() - (core.getTime() - input_event.timestamp)
+
+        return Response(self.side_keys.get(input_event.key), input_event.key, rt, input_event.timestamp, self.name)
+
+    def wait_response(self, clock=None, target_pos=None, forced=False):
+        return self._wait(sorted(self.side_keys), clock)
+
+    def wait_any(self):
+        return self._wait(self.any_keys, None)
+
+class KeyboardDevice(InputDevice):
+    name = 'keyboard'
+    source = 'keyboard'
+    side_keys = {'c': LEFT, 'm': RIGHT}
+
+class SRBoxDevice(InputDevice):
+    name = 'srbox'
+    source = 'srbox'
+    side_keys = {1: LEFT, 5: RIGHT}
+    any_keys = [1, 2, 3, 4, 5]
+
+    def __init__(self, srbox, inputs):
+        InputDevice.__init__(self, inputs)
+        self.srbox = srbox
+
+    def _wait(self, keys, clock):
+        self.srbox.start_input()
+        try:
+            return InputDevice._wait(self, keys, clock)
+        finally:
+            self.srbox.stop_input()
+
+class SimulatedDevice(ResponseDevice):
+    name = 'simulated'
+    side_keys = {'left': LEFT, 'right': RIGHT}
+
+    def __init__(self, rt_distribution=None, error_rate=0.02, seed=None, timeline=None):
+        self.random = np.random.RandomState(seed)
+        self.error_rate = error_rate
+
+        # Headless sessions pass in their virtual timeline so the simulated
+        # RT still elapses on every clock in the session
+        self.timeline = timeline
+
+        if rt_distribution is None:
+            self.rt_distribution = lambda random: 0.5 + random.random_sample()
+        elif hasattr(rt_distribution, 'rvs'):
+            self.rt_distribution = lambda random: rt_distribution.rvs(random_state=random)
+        else:
+            self.rt_distribution = rt_distribution
+
+    def wait_response(self, clock=None, target_pos=None, forced=False):
+        logging.exp(u'Autorun active. Sending automatic response...')
+
+        if target_pos is None:
+            target_pos = RIGHT
+        if not forced and self.random.random_sample() < self.error_rate:
+            side = int(not target_pos)
+        else:
+            side = target_pos
+
+        key = 'left' if side == LEFT else 'right'
+        rt = float(self.rt_distribution(self.random))
+        if self.timeline is not None:
+            self.timeline.advance(rt)
+            return Response(side, key, rt, self.timeline.getTime(), self.name)
+
+        if clock is None:
+            return Response(side, key, rt, core.getTime() + rt, self.name)
+
+        # The response is returned straight away; its timestamp is where a
+        # participant with this RT would have landed
+        return Response(side, key, rt, core.getTime() + (rt - clock.getTime()), self.name)
+
+    def wait_any(self):
+        return self.wait_response()
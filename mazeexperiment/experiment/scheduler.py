@@ -0,0 +1,114 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function
+from psychopy import logging
+
+# Onsets are planned as frame indices on a global frame counter. The counter
+# is derived from flip timestamps, so a slow frame advances it by more than
+# one and the current phase is cut short instead of pushing every later
+# onset back. Consecutive present() calls are chained: each phase starts on
+# the frame the previous one was scheduled to end on. The chain restarts at
+# the next flip after a flip made outside the scheduler or after a wait
+# longer than MAX_SLIP (such as waiting for a response).
+
+MAX_SLIP = 0.25
+
+class FrameScheduler():
+    def __init__(self, experiment, frame_dur, max_slip=MAX_SLIP):
+        self.experiment = experiment
+        self.frame_dur = frame_dur
+        self.max_slip = max_slip
+
+        self.frame = -1
+        self.next_frame = None
+        self.last_onset = None
+        self.slips = 0
+
+        self._origin_time = None
+        self._origin_frame = 0
+        self._last_flip = None
+        self._presenting = False
+
+    def frames(self, duration):
+        return int(round(duration / self.frame_dur))
+
+    def frame_time(self, frame):
+        return self._origin_time + (frame - self._origin_frame) * self.frame_dur
+
+    def set_frame_dur(self, frame_dur):
+        if self._last_flip is not None:
+            self._origin_time = self._last_flip
+            self._origin_frame = self.frame
+        self.frame_dur = frame_dur
+
+    def flipped(self, flip_time):
+        if self._origin_time is None:
+            self._origin_time = flip_time
+            self._origin_frame = 0
+            self.frame = 0
+        else:
+            elapsed = int(round((flip_time - self._origin_time) / self.frame_dur))
+            self.frame = max(self.frame + 1, self._origin_frame + elapsed)
+        self._last_flip = flip_time
+
+        if not self._presenting:
+            self.next_frame = None
+
+    def resync(self):
+        self.next_frame = None
+
+    def present(self, phase, frames, draw=None, flip=None, until=None, timed=True):
+        if frames <= 0:
+            return None
+
+        flip = self.experiment.flip if flip is None else flip
+        frame_timer = self.experiment.frame_timer
+
+        onset = self.next_frame
+        if onset is not None and logging.defaultClock.getTime() - self.frame_time(onset) > self.max_slip:
+            onset = None
+
+        if timed:
+            frame_timer.begin_phase(phase, frames * self.frame_dur)
+
+        result = None
+        first = True
+        self._presenting = True
+        try:
+            while True:
+                if draw is not None:
+                    draw()
+                flip_time = flip()
+
+                if first:
+                    if onset is None:
+                        onset = self.frame
+                    self._record_onset(phase, onset, flip_time)
+                    first = False
+
+                if until is not None:
+                    result = until()
+                    if result:
+                        break
+                if self.frame + 1 >= onset + frames:
+                    break
+        finally:
+            self._presenting = False
+
+        if timed:
+            frame_timer.end_phase()
+        self.next_frame = onset + frames
+        return result
+
+    def _record_onset(self, phase, onset, flip_time):
+        slip = self.frame - onset
+        self.last_onset = {
+            'phase': phase,
+            'frame': onset,
+            'scheduled': self.frame_time(onset),
+            'actual': flip_time,
+            'slip': slip
+        }
+        if slip > 0:
+            self.slips += 1
+            logging.exp(u'Onset of {} slipped {} frames'.format(phase, slip))
@@ -0,0 +1,75 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function
+from psychopy import logging
+
+from multiprocessing import Pool
+import csv
+import glob
+import io
+import os, sys
+
+MERGED_FILE = u'simulated_sessions.csv'
+
+def open_csv(path, mode='r'):
+    if sys.version_info[0] < 3:
+        return open(path, mode + 'b')
+    return io.open(path, mode, newline='', encoding='utf-8')
+
+def run_participant(job):
+    # Runs in a pool worker; imported here so each worker builds its own
+    # PsychoPy state instead of inheriting the parent's
+    from . import Experiment
+
+    pwd, exp_name, participant, seed, data_dir = job
+    if not os.path.isdir(data_dir):
+        os.makedirs(data_dir)
+
+    Experiment(
+        exp_name=exp_name, pwd=pwd, headless=True,
+        participant=participant, seed=seed, data_dir=data_dir
+    )
+
+    return participant, sorted(glob.glob(os.path.join(data_dir, u'*.csv')))
+
+def merge_csvs(paths, merged_path):
+    fieldnames = []
+    for path in paths:
+        with open_csv(path) as csv_file:
+            for name in next(csv.reader(csv_file), []):
+                if name not in fieldnames:
+                    fieldnames.append(name)
+
+    with open_csv(merged_path, 'w') as merged_file:
+        writer = csv.DictWriter(merged_file, fieldnames=fieldnames, restval='')
+        writer.writeheader()
+        for path in paths:
+            with open_csv(path) as csv_file:
+                for row in csv.DictReader(csv_file):
+                    writer.writerow(row)
+
+    return merged_path
+
+def simulate_participants(n, output_dir, pwd, exp_name=u'RPACR', first_participant=1,
+                          base_seed=0, processes=None):
+    jobs = []
+    for participant in range(first_participant, first_participant + n):
+        jobs.append((
+            pwd, exp_name, participant, base_seed + participant,
+            os.path.join(output_dir, u'participant_{:0>3}'.format(participant))
+        ))
+
+    # One session per worker process: PsychoPy's logger keeps every message
+    # it has flushed, so long-lived workers would keep growing
+    pool = Pool(processes=processes, maxtasksperchild=1)
+    try:
+        paths = []
+        for participant, csv_paths in pool.imap_unordered(run_participant, jobs):
+            logging.info(u'Participant {:0>3} finished'.format(participant))
+            logging.flush()
+            paths.extend(csv_paths)
+    finally:
+        pool.close()
+        pool.join()
+
+    return merge_csvs(sorted(paths), os.path.join(output_dir, MERGED_FILE))
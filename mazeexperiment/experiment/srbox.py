@@ -1,17 +1,133 @@
 from __future__ import absolute_import, division, print_function
-from psychopy import core
+from psychopy import core, logging
 
+import numpy as np
 import serial
 import serial.tools.list_ports
-import time
+from contextlib import contextmanager
 from decimal import Decimal
-from threading import Thread, Event
+from threading import Thread, Event, Condition, Lock
+
+from .lights import LightController
+
+# How long the reader thread blocks in the driver waiting for the next byte
+READER_TIMEOUT = 0.05
+
+# Once input is started the box sends one status byte every 1.25 ms
+SAMPLE_RATE = 800
+SAMPLE_PERIOD = 1 / SAMPLE_RATE
+
+# With sample timing the reader can afford to collect bytes in large batches
+SAMPLE_READ_INTERVAL = 0.02
+
+# The buffer keeps state changes, at most one per status byte, so it holds
+# at least this many seconds of input; recordKeys() grows it for longer waits
+BUFFER_SECONDS = 60
+
+# Buttons held down for every possible status byte, indexed by the byte value
+BUTTON_TABLE = tuple(
+    tuple(bit + 1 for bit in range(5) if byte & (1 << bit))
+    for byte in range(256)
+)
+
+def _state_edges(values, previous=None):
+    # Positions in a chunk where the button state differs from the byte before
+    changed = np.empty(len(values), dtype=bool)
+    if len(values) == 0:
+        return np.flatnonzero(changed)
+
+    changed[0] = previous is None or values[0] != previous
+    np.not_equal(values[1:], values[:-1], out=changed[1:])
+    return np.flatnonzero(changed)
+
+class _RingBuffer():
+    def __init__(self, size):
+        self.size = size
+        self._values = np.zeros(size, dtype=np.uint8)
+        self._stamps = np.zeros(size, dtype=np.float64)
+
+        # Total number of bytes ever written; read positions are absolute
+        self._written = 0
+        self._ready = Condition()
+
+        # Entries that were overwritten before anyone read them
+        self.lost = 0
+
+    def reserve(self, size):
+        # Grow to at least `size` entries, keeping what is stored
+        with self._ready:
+            if size <= self.size:
+                return
+
+            # Entries keep their absolute positions, modulo the new size
+            kept = np.arange(max(0, self._written - self.size), self._written)
+            values = np.zeros(size, dtype=np.uint8)
+            stamps = np.zeros(size, dtype=np.float64)
+            values[kept % size] = self._values[kept % self.size]
+            stamps[kept % size] = self._stamps[kept % self.size]
+
+            self.size = size
+            self._values = values
+            self._stamps = stamps
+
+    @property
+    def written(self):
+        with self._ready:
+            return self._written
+
+    def extend(self, values, stamps):
+        stamps = np.broadcast_to(stamps, values.shape)
+        with self._ready:
+            skipped = max(0, len(values) - self.size)
+            if skipped:
+                values = values[skipped:]
+                stamps = stamps[skipped:]
+                self._written += skipped
+
+            start = self._written % self.size
+            end = start + len(values)
+            if end <= self.size:
+                self._values[start:end] = values
+                self._stamps[start:end] = stamps
+            else:
+                split = self.size - start
+                self._values[start:] = values[:split]
+                self._values[:end - self.size] = values[split:]
+                self._stamps[start:] = stamps[:split]
+                self._stamps[:end - self.size] = stamps[split:]
+
+            self._written += len(values)
+            self._ready.notify_all()
+
+    def read(self, position, timeout=None):
+        with self._ready:
+            if self._written <= position:
+                self._ready.wait(timeout)
+
+            written = self._written
+            # Anything older than one full buffer has been overwritten
+            if position < written - self.size:
+                lost = written - self.size - position
+                self.lost += lost
+                logging.warning(u'SRBox input buffer overrun, {} state changes lost'.format(lost))
+                position = written - self.size
+            start = position % self.size
+            end = start + (written - position)
+            if end <= self.size:
+                values = self._values[start:end].copy()
+                stamps = self._stamps[start:end].copy()
+            else:
+                values = np.concatenate((self._values[start:], self._values[:end - self.size]))
+                stamps = np.concatenate((self._stamps[start:], self._stamps[:end - self.size]))
+
+        return values, stamps, written
 
 class SRBox():
-    def __init__(self, port=None, baudrate=19200, timeout=0):
+    def __init__(self, port=None, baudrate=19200, timeout=0, buffer_size=None, sample_timing=False):
         self.port = port
         self.baudrate = baudrate
         self.timeout = timeout
+        self.sample_timing = sample_timing
 
         if port is None:
             ports = []
@@ -33,43 +149,132 @@ class SRBox():
         if self._box is None:
             raise RuntimeError('Could not connect to SRBox')
 
+        # Commands from the light thread and from input control share the port
+        self._write_lock = Lock()
+
         self._light_codes = [0b00001, 0b00010, 0b00100, 0b01000, 0b10000]
         self._lights = [False]*5
         self.update_lights()
-
-        self._button_codes = [0b00001, 0b00010, 0b00100, 0b01000, 0b10000]
+        self.lights = LightController(self.write_lights)
 
         self._reading = False
-
-        self._record_thread = None
-        self._recorded_pressed = None
-
+        self._input_start = 0
+        self._edge_state = None
+
+        # In sample timing mode the time of a byte is derived from its index
+        # since start_input() rather than from when the reader got to it
+        self._input_lock = Lock()
+        self._sample_anchor = 0.0
+        self._sample_count = 0
+        # Bumped by start_input(); a chunk read under an older generation
+        # belongs to input from before the reset and is dropped
+        self._generation = 0
+        self._read_interval = SAMPLE_READ_INTERVAL if sample_timing else 0
+
+        self._recording = None
+
+        # The reader thread owns all reads from the port. It blocks in the
+        # driver instead of spinning and only hands state changes over
+        # through the buffer. Flushing the port waits for a read in progress
+        # to finish and holds the reader off until it is done.
+        if buffer_size is None:
+            buffer_size = int(SAMPLE_RATE * BUFFER_SECONDS)
+        self._buffer = _RingBuffer(buffer_size)
+        self._port_state = Condition()
+        self._port_paused = False
+        self._port_reading = False
+        self._box.timeout = READER_TIMEOUT
+        self._stop_reader = Event()
+        self._reader_thread = Thread(target=self._reader)
+        self._reader_thread.daemon = True
+        self._reader_thread.start()
 
     def _signal(self, byte):
         if type(byte) is int:
             byte = chr(int)
-        return self._box.write(byte)
-
-    def _read(self):
-        byte = ''
-        while byte == '':
-            byte = self._box.read(1)
-
-        return byte
+        with self._write_lock:
+            return self._box.write(byte)
+
+    @contextmanager
+    def _reader_paused(self):
+        with self._port_state:
+            self._port_paused = True
+            while self._port_reading:
+                self._port_state.wait()
+        try:
+            yield
+        finally:
+            with self._port_state:
+                self._port_paused = False
+                self._port_state.notify_all()
+
+    def _reader(self):
+        while not self._stop_reader.is_set():
+            with self._port_state:
+                while self._port_paused:
+                    self._port_state.wait()
+                self._port_reading = True
+                generation = self._generation
+            try:
+                chunk = self._box.read(max(1, self._box.in_waiting))
+            except (serial.SerialException, ValueError, TypeError):
+                break
+            finally:
+                with self._port_state:
+                    self._port_reading = False
+                    self._port_state.notify_all()
+
+            if chunk:
+                stamp = core.getTime()
+                values = np.frombuffer(chunk, dtype=np.uint8)
+                with self._input_lock:
+                    if generation != self._generation:
+                        continue
+                    edges = _state_edges(values, self._edge_state)
+                    if self.sample_timing:
+                        stamp = self._sample_anchor + (self._sample_count + edges + 1) * SAMPLE_PERIOD
+                    self._sample_count += len(values)
+                    self._edge_state = values[-1]
+                    if len(edges):
+                        self._buffer.extend(values[edges], stamp)
+
+            if self._read_interval:
+                self._stop_reader.wait(self._read_interval)
+
+    def _clock_time(self, clock, stamp):
+        # Convert a reader timestamp into the time shown by `clock` at that moment
+        if hasattr(clock, 'getTime'):
+            return clock.getTime() - (core.getTime() - stamp)
+        return stamp
+
+    def _valid_keys(self, pressed, keyList=None):
+        if keyList is None:
+            return pressed
+        return [key for key in pressed if key in keyList]
 
     def start_input(self):
-        self._box.reset_input_buffer()
-        self._box.reset_output_buffer()
-        self._signal(chr(0b10100000))
+        with self._reader_paused(), self._input_lock:
+            self._box.reset_input_buffer()
+            self._box.reset_output_buffer()
+            self._generation += 1
+            self._input_start = self._buffer.written
+            self._edge_state = None
+            self._sample_count = 0
+            self._sample_anchor = core.getTime()
+            self._signal(chr(0b10100000))
         self._reading = True
 
     def stop_input(self):
-        self._box.reset_input_buffer()
-        self._box.reset_output_buffer()
-        self._signal(chr(0b00100000))
+        with self._reader_paused():
+            self._box.reset_input_buffer()
+            self._box.reset_output_buffer()
+            self._signal(chr(0b00100000))
         self._reading = False
 
     def close(self):
+        self.lights.close()
+        self._stop_reader.set()
+        self._reader_thread.join()
         self._box.reset_input_buffer()
         self._box.reset_output_buffer()
         self._reading = False
@@ -79,139 +284,107 @@ class SRBox():
         if not self._reading:
             self.start_input()
 
-        if timeStamped:
-            clock = timeStamped.getTime
-            timeStamped = True
-        else:
-            clock = time.time
-
         if maxWait is None:
-            run_infinite = True
+            deadline = None
         else:
-            run_infinite = False
-
-        start_time = clock()
-        current_time = start_time
-        while run_infinite or (current_time - start_time < maxWait):
-            current_time = clock()
-            keys = ord(self._read())
-            if keys == 0:
-                continue
-            pressed = self._keys_pressed(keys)
-
-            if keyList is not None:
-                valid_keys = []
-                for key in pressed:
-                    if key in keyList:
-                        valid_keys.append(key)
+            deadline = core.getTime() + maxWait
+
+        position = self._input_start
+        while True:
+            if deadline is None:
+                remaining = None
             else:
-                valids_keys = pressed
+                remaining = deadline - core.getTime()
+                if remaining <= 0:
+                    break
 
-            if len(valid_keys) > 0:
-                self.stop_input()
-                if timeStamped:
-                    return valid_keys, current_time
-                else:
-                    return valid_keys
+            values, stamps, position = self._buffer.read(position, remaining)
+            for i in np.flatnonzero(values):
+                valid_keys = self._valid_keys(self._keys_pressed(values[i]), keyList)
+
+                if len(valid_keys) > 0:
+                    self.stop_input()
+                    if timeStamped:
+                        return valid_keys, self._clock_time(timeStamped, stamps[i])
+                    else:
+                        return valid_keys
 
         return []
 
+    def read_presses(self, position=None):
+        # Non-blocking: every press since `position` (or since input started)
+        # as (keys, reader timestamp), plus the position to read from next
+        if position is None or position < self._input_start:
+            position = self._input_start
+
+        values, stamps, position = self._buffer.read(position, 0)
+        presses = []
+        for i in np.flatnonzero(values):
+            presses.append((self._keys_pressed(values[i]), stamps[i]))
+
+        return presses, position
+
     def recordKeys(self, keyList=None, timeStamped=False, maxWait=30):
-        if self._record_thread is not None:
+        if self._recording is not None:
             raise RuntimeError('Cannot call recordKeys() more than once without calling getKeys()')
         if self._reading:
             raise RuntimeError('Cannot record keys pressed before recordKeys() is called')
 
-        self._record_thread = Thread(target=self._recorder, args=(keyList, timeStamped))
-        self._record_thread.start()
+        # Every state change up to maxWait has to fit in the buffer until
+        # get_keys() reads them all at once
+        if maxWait:
+            self._buffer.reserve(int(SAMPLE_RATE * maxWait) + 1)
 
-    def _recorder(self, keyList=None, timeStamped=False, maxWait=30):
-        self._continue_recording = True
-        if timeStamped:
-            clock = timeStamped.getTime
-            timeStamped = True
-        else:
-            clock = time.time
+        self.start_input()
+        self._recording = {
+            'keyList': keyList,
+            'timeStamped': timeStamped,
+            'maxWait': maxWait,
+            'start_time': core.getTime(),
+            'position': self._input_start
+        }
 
-        if maxWait is None or maxWait is False:
-            run_infinite = True
-        else:
-            run_infinite = False
+    def get_keys(self, keyList=None, timeout=-1, timeStamp=False):
+        if self._recording is None:
+            raise RuntimeError('recordKeys() method must be called before keys are available')
 
-        self._recorded_presses = []
+        recording = self._recording
+        self._recording = None
 
-        start_time = clock()
-        current_time = start_time
-        last_keys = 0
-        while self._continue_recording and (run_infinite or (current_time - start_time < maxWait)):
-            current_time = clock()
-            keys = ord(self._read())
-            if keys == last_keys:
-                continue
-            else:
-                last_keys = keys
+        values, stamps, position = self._buffer.read(recording['position'], 0)
+        self.stop_input()
 
-            keys = self._keys_pressed(keys)
+        start_time = recording['start_time']
+        if recording['maxWait'] is not None and recording['maxWait'] is not False:
+            in_window = (stamps - start_time) < recording['maxWait']
+            values = values[in_window]
+            stamps = stamps[in_window]
 
-            if keyList is not None:
-                valid_keys = []
-                for key in keys:
-                    if key in keyList:
-                        valid_keys.append(key)
-            else:
-                valids_keys = keys
+        presses = []
+        last_keys = 0
+        for value, stamp in zip(values, stamps):
+            last_keys = value
 
+            valid_keys = self._valid_keys(self._keys_pressed(value), recording['keyList'])
             if len(valid_keys) > 0:
-                if timeStamped:
-                    self._recorded_presses.append((valid_keys, current_time-start_time))
+                if recording['timeStamped']:
+                    presses.append((valid_keys, stamp - start_time))
                 else:
-                    self._recorded_presses.extend(valid_keys)
+                    presses.extend(valid_keys)
 
-        if last_keys != 0 and timeStamped:
-            self._recorded_presses.append((current_time-start_time, self._keys_pressed(last_keys)))
+        if last_keys != 0 and recording['timeStamped']:
+            end_time = core.getTime() - start_time
+            if recording['maxWait'] is not None and recording['maxWait'] is not False:
+                end_time = min(end_time, recording['maxWait'])
+            presses.append((self._keys_pressed(last_keys), end_time))
 
-        if not timeStamped:
-            self._recorded_presses = list(set(self._recorded_presses))
+        if not recording['timeStamped']:
+            presses = list(set(presses))
 
-
-    def get_keys(self, keyList=None, timeout=-1, timeStamp=False):
-        if self._recorded_presses is None:
-            raise RuntimeError('recordKeys() method must be called before keys are available')
-
-        self._continue_recording = False
-        self.stop_input()
-        presses = self._recorded_presses
-        self._recorded_presses = None
         return presses
 
-        # pressed = []
-        #
-        # start_time = time.time()
-        # current_time = start_time
-        # last_keys= 0
-        # while current_time - start_time < timeout:
-        #     current_time = time.time()
-        #     keys = ord(self._read())
-        #     if keys == last_keys:
-        #         continue
-        #     elif len(pressed) > 0 and current_time-pressed[-1][0] < .002:
-        #         continue
-        #     else:
-        #         pressed.append((current_time-start_time, self._keys_pressed(keys)))
-        #         last_keys = keys
-        #
-        # if last_keys != 0 and abs(pressed[-1][0] - (current_time-start_time)) > 0.00125:
-        #     pressed.append((current_time-start_time, self._keys_pressed(last_keys)))
-        #
-        # return pressed
-
     def _keys_pressed(self, keys):
-        pressed = []
-        for bit in range(5):
-            if ((keys&(self._button_codes[bit]))!=0):
-                pressed.append(bit + 1)
-
-        return pressed
+        return list(BUTTON_TABLE[keys])
 
     # def _get_bit(self, byte, bit):
     #     return ((byte&(self.masks[bit-1]))!=0)
@@ -239,21 +412,13 @@ class SRBox():
         if update:
             self.update_lights()
 
+    def write_lights(self, lights):
+        self.set_lights(lights, update=True)
+
     def blink_lights(self, lights, interval=0.25, duration=1):
+        # Returns at once; the light thread blinks them and turns them off
         if type(lights) is int:
-            lights = tuple(lights)
-
-        set_on = True
-        start = time.time()
-        interval_start = start
-        while time.time() - start < duration:
-            if time.time() - interval_start >= interval:
-                for light in lights:
-                    self.set_light(light, set_on)
-                self.update_lights()
-                interval_start = time.time()
-                set_on = (not set_on)
-
-        for light in lights:
-            self.set_light(light, False)
-        self.update_lights()
+            lights = (lights,)
+
+        states = [light + 1 in lights for light in range(len(self._lights))]
+        self.lights.blink(states, interval * 2000, duration * 1000)
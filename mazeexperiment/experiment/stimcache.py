@@ -0,0 +1,70 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function
+from psychopy import core, logging
+
+from collections import OrderedDict, deque
+
+from .responses import LEFT, RIGHT
+
+CACHE_SIZE = 256
+
+# Setting the text of a TextStim lays the string out and uploads a new
+# texture, which for CJK fonts can take longer than a frame. The cache keeps
+# one ready-made stimulus per (side, word) so that showing a pair only has to
+# draw them. Words are queued before a sentence and rendered a few at a time
+# between fixation flips.
+
+class StimulusCache():
+    def __init__(self, text_stim, window, styles, size=CACHE_SIZE):
+        self.text_stim = text_stim
+        self.window = window
+        self.styles = styles
+        self.size = size
+
+        self._stims = OrderedDict()
+        self._pending = deque()
+
+    def __len__(self):
+        return len(self._stims)
+
+    def __contains__(self, key):
+        return key in self._stims
+
+    def queue_pairs(self, pairs):
+        # The target side is only decided at onset, so both words are
+        # rendered on both sides
+        for pair in pairs:
+            for word in (pair['pair_correct'], pair['pair_distractor']):
+                for side in (LEFT, RIGHT):
+                    if (side, word) not in self._stims:
+                        self._pending.append((side, word))
+
+    def step(self, budget):
+        # Render queued words until the time budget (in seconds) is used up
+        deadline = core.getTime() + budget
+        while self._pending and core.getTime() < deadline:
+            side, word = self._pending.popleft()
+            self.get(side, word)
+
+    def finish(self):
+        if self._pending:
+            logging.debug(u'Pre-rendering {} remaining words'.format(len(self._pending)))
+        while self._pending:
+            side, word = self._pending.popleft()
+            self.get(side, word)
+
+    def get(self, side, word):
+        key = (side, word)
+        stim = self._stims.pop(key, None)
+        if stim is None:
+            stim = self.text_stim(win=self.window, text=word, **self.styles[side])
+            if len(self._stims) >= self.size:
+                self._stims.popitem(last=False)
+
+        self._stims[key] = stim
+        return stim
+
+    def clear(self):
+        self._stims.clear()
+        self._pending.clear()
@@ -0,0 +1,246 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function
+
+import numpy as np
+
+import io
+import json
+import mmap
+import os, sys
+import struct
+
+# Compact stimulus file: a JSON header followed by flat arrays. Every word,
+# distractor and sentence is stored once in an interned string table and
+# sentences refer to it through integer indices, so loading the file is a
+# memory map rather than building thousands of small lists.
+#
+#   MAGIC | uint32 header length | header | padding | arrays...
+
+MAGIC = b'MAZESTIM'
+STORE_VERSION = 1
+STORE_EXTENSION = u'.stim'
+ALIGNMENT = 8
+
+MISSING = -1
+
+class _StringTable():
+    def __init__(self):
+        self.strings = []
+        self.index = {}
+
+    def intern(self, string):
+        if string is None:
+            return MISSING
+        if string not in self.index:
+            self.index[string] = len(self.strings)
+            self.strings.append(string)
+        return self.index[string]
+
+    def arrays(self):
+        encoded = [string.encode('utf-8') for string in self.strings]
+        offsets = np.zeros(len(encoded) + 1, dtype=np.int32)
+        offsets[1:] = np.cumsum([len(string) for string in encoded])
+        blob = np.frombuffer(b''.join(encoded), dtype=np.uint8)
+        return blob, offsets
+
+def convert(json_file, store_file):
+    with io.open(json_file, 'r', encoding='utf-8') as source:
+        contents = json.load(source)
+    sentences = contents['sentences']
+
+    distractor_keys = []
+    for sentence in sentences:
+        for key in sentence.get('distractors', {}):
+            if key not in distractor_keys:
+                distractor_keys.append(key)
+    distractor_keys.sort()
+
+    strings = _StringTable()
+    n_sentences = len(sentences)
+    sentence_number = np.zeros(n_sentences, dtype=np.int32)
+    full_sentence = np.zeros(n_sentences, dtype=np.int32)
+    critical_target = np.zeros(n_sentences, dtype=np.int32)
+    pair_offsets = np.zeros(n_sentences + 1, dtype=np.int32)
+    distractors = np.full((n_sentences, len(distractor_keys)), MISSING, dtype=np.int32)
+    original_distractors = np.full((n_sentences, len(distractor_keys)), MISSING, dtype=np.int32)
+    pairs = []
+
+    for i, sentence in enumerate(sentences):
+        sentence_number[i] = int(sentence['sentence_number'])
+        full_sentence[i] = strings.intern(sentence.get('full_sentence'))
+        critical_target[i] = strings.intern(sentence.get('critical_target'))
+
+        for j, key in enumerate(distractor_keys):
+            distractors[i, j] = strings.intern(sentence.get('distractors', {}).get(key))
+            original_distractors[i, j] = strings.intern(sentence.get('original_distractors', {}).get(key))
+
+        for pair in sentence['sentence']:
+            pairs.append((strings.intern(pair[0]), strings.intern(pair[1])))
+        pair_offsets[i + 1] = len(pairs)
+
+    string_blob, string_offsets = strings.arrays()
+    arrays = [
+        ('string_blob', string_blob),
+        ('string_offsets', string_offsets),
+        ('sentence_number', sentence_number),
+        ('full_sentence', full_sentence),
+        ('critical_target', critical_target),
+        ('pair_offsets', pair_offsets),
+        ('pairs', np.array(pairs, dtype=np.int32).reshape(-1, 2)),
+        ('distractors', distractors),
+        ('original_distractors', original_distractors)
+    ]
+
+    write_store(store_file, arrays, {'distractor_keys': distractor_keys, 'design': contents.get('design')})
+    return store_file
+
+def _aligned(position):
+    return position + (-position % ALIGNMENT)
+
+def write_store(store_file, arrays, extra):
+    # Array offsets are relative to the first aligned byte after the header
+    layout = {}
+    position = 0
+    for name, array in arrays:
+        position = _aligned(position)
+        layout[name] = [array.dtype.str, list(array.shape), position]
+        position += array.nbytes
+
+    header = dict(extra)
+    header['version'] = STORE_VERSION
+    header['arrays'] = layout
+    header_bytes = json.dumps(header, sort_keys=True).encode('utf-8')
+    data_start = _aligned(len(MAGIC) + 4 + len(header_bytes))
+
+    with open(store_file, 'wb') as store:
+        store.write(MAGIC)
+        store.write(struct.pack('<I', len(header_bytes)))
+        store.write(header_bytes)
+        for name, array in arrays:
+            store.write(b'\0' * (data_start + layout[name][2] - store.tell()))
+            store.write(np.ascontiguousarray(array).tobytes())
+
+class StimulusStore():
+    def __init__(self, store_file):
+        self.store_file = store_file
+        with open(store_file, 'rb') as store:
+            self._map = mmap.mmap(store.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if self._map[:len(MAGIC)] != MAGIC:
+            raise ValueError(u'{} is not a stimulus store'.format(store_file))
+
+        header_length = struct.unpack('<I', self._map[len(MAGIC):len(MAGIC) + 4])[0]
+        header_start = len(MAGIC) + 4
+        header = json.loads(self._map[header_start:header_start + header_length].decode('utf-8'))
+        if header['version'] != STORE_VERSION:
+            raise ValueError(u'{} has unsupported store version {}'.format(store_file, header['version']))
+
+        data_start = _aligned(header_start + header_length)
+        for name, (dtype, shape, offset) in header['arrays'].items():
+            count = int(np.prod(shape))
+            array = np.frombuffer(self._map, dtype=np.dtype(dtype), count=count, offset=data_start + offset)
+            setattr(self, name, array.reshape(shape))
+
+        self.distractor_keys = header['distractor_keys']
+        self.design = header.get('design')
+        self._strings = None
+
+    # A store reads like the list of sentences in trials.json, but each
+    # sentence is only built when it is asked for
+    def __len__(self):
+        return len(self.sentence_number)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        return self.sentence(i)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self.sentence(i)
+
+    def strings(self):
+        # The whole table is decoded in one pass the first time it is needed
+        if self._strings is None:
+            blob = self.string_blob.tobytes()
+            offsets = self.string_offsets.tolist()
+            self._strings = [blob[start:end].decode('utf-8') for start, end in zip(offsets, offsets[1:])]
+        return self._strings
+
+    def string(self, index):
+        index = int(index)
+        if index == MISSING:
+            return None
+        return self.strings()[index]
+
+    def sentence_pairs(self, i):
+        strings = self.strings()
+        start, end = self.pair_offsets[i], self.pair_offsets[i + 1]
+        return [[strings[target], strings[alternative]] for target, alternative in self.pairs[start:end].tolist()]
+
+    def sentence(self, i):
+        # Rebuilds the trials.json schema for a single sentence
+        sentence = {
+            'sentence_number': int(self.sentence_number[i]),
+            'sentence': self.sentence_pairs(i)
+        }
+
+        for key, column in (('full_sentence', self.full_sentence), ('critical_target', self.critical_target)):
+            if column[i] != MISSING:
+                sentence[key] = self.string(column[i])
+
+        for key, table in (('distractors', self.distractors), ('original_distractors', self.original_distractors)):
+            values = {}
+            for condition, index in zip(self.distractor_keys, table[i].tolist()):
+                if index != MISSING:
+                    values[condition] = self.string(index)
+            if values:
+                sentence[key] = values
+
+        return sentence
+
+
+def stimulus_file(json_file):
+    # Prefer a converted store next to the JSON file unless the JSON is newer
+    store_file = os.path.splitext(json_file)[0] + STORE_EXTENSION
+    if os.path.exists(store_file) and os.path.getmtime(store_file) >= os.path.getmtime(json_file):
+        return store_file
+    return json_file
+
+def load_sentences(path):
+    # Sentences from a store stay in the memory map until they are used
+    if path.endswith(STORE_EXTENSION):
+        return StimulusStore(path)
+
+    with io.open(path, 'r', encoding='utf-8') as source:
+        return json.load(source)['sentences']
+
+def sentence_numbers(sentences):
+    if isinstance(sentences, StimulusStore):
+        return sentences.sentence_number.tolist()
+    return [int(sentence['sentence_number']) for sentence in sentences]
+
+def load_design(path):
+    # Counterbalancing design declared by the stimulus file, if any
+    if path.endswith(STORE_EXTENSION):
+        return StimulusStore(path).design
+
+    with io.open(path, 'r', encoding='utf-8') as source:
+        return json.load(source).get('design')
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if not argv:
+        print('usage: python -m mazeexperiment.experiment.stimstore FILE.json [FILE.json ...]')
+        return 1
+
+    for json_file in argv:
+        store_file = convert(json_file, os.path.splitext(json_file)[0] + STORE_EXTENSION)
+        print('{} -> {}'.format(json_file, store_file))
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
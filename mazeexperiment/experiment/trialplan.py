@@ -0,0 +1,176 @@
+#!/usr/bin/env python2
+# -*- coding: utf-8 -*-
+from __future__ import absolute_import, division, print_function
+from psychopy import logging
+
+import hashlib
+import io
+import json
+import os
+
+from .stimstore import load_design, load_sentences, sentence_numbers
+from .counterbalance import BLOCKS, cached_square, condition_vectors, design_shape, load_square, square_rows
+
+# Bump whenever the contents of a compiled plan change
+PLAN_VERSION = 5
+
+CONDITIONS = {
+    1: 'both_sim',
+    2: 'orth_sim',
+    3: 'phon_sim',
+    4: 'both_dif'
+}
+
+def counterbalancing(latin_square, participant_id, blocks=BLOCKS):
+    # The session's rows of the square and its conditions, as stored in the
+    # plan so a cached plan can log them too
+    rows = square_rows(latin_square, [participant_id], blocks)[0]
+    return {
+        'rows': rows.tolist(),
+        'cells': latin_square[rows].tolist(),
+        'conditions': condition_vectors(latin_square, [participant_id], blocks, len(CONDITIONS))[0].tolist()
+    }
+
+def log_counterbalancing(record):
+    width = len(record['cells'][0])
+    for i, (row_id, cells) in enumerate(zip(record['rows'], record['cells'])):
+        logging.info(u'       {}'.format(''.join(['{:>4}'.format((x+(i*width))) for x in range(1,width+1)])))
+        logging.info(u'Row {:>2}:{}'.format(row_id, ''.join(['{:>4}'.format(x) for x in cells])))
+
+    logging.info(u'Participant latin square: {}'.format([x for cells in record['cells'] for x in cells]))
+    logging.info(u'Participant conditions: {}'.format(record['conditions']))
+
+def process_sentence(sentence_pairs, distractor):
+    # critical_index counts the pairs in the stimulus file; critical_pair is
+    # the position of the critical word among the pairs shown, after pairs
+    # marked * have been joined onto the word before them
+    target = []
+    alternative = []
+    critical_index = 0
+    critical_pair = 0
+    count = 0
+    for pair in sentence_pairs:
+        if u'＃' in pair[1]:
+            target.append(pair[0])
+            alternative.append(distractor)
+            critical_index = count
+            critical_pair = len(target) - 1
+        elif pair[1] == u'*':
+                target[-1] = u'{}{}'.format(target[-1], pair[0])
+                alternative[-1] = u'{}{}'.format(alternative[-1], pair[0])
+        else:
+            target.append(pair[0])
+            alternative.append(pair[1])
+
+        count += 1
+
+    return u' | '.join(target), u' | '.join(alternative), critical_index, critical_pair
+
+def prepare_sentence(trial):
+    trial['critical_distractor'] = trial['distractors'][CONDITIONS[trial['condition']]]
+    (trial['target_sentence'], trial['alt_sentence'],
+     trial['critical_index'], trial['critical_pair']) = process_sentence(
+        trial['sentence'], trial['critical_distractor']
+    )
+
+    del trial['sentence']
+    del trial['distractors']
+    if 'original_distractors' in trial:
+        del trial['original_distractors']
+
+    return trial
+
+class TrialPlan():
+    def __init__(self, trials_file, square_file, cache_dir):
+        self.trials_file = trials_file
+        self.square_file = square_file
+        self.cache_dir = cache_dir
+
+    def key(self, participant_id):
+        digest = hashlib.sha1()
+        digest.update(u'{}:{}'.format(PLAN_VERSION, participant_id).encode('utf-8'))
+        # Without a square file the square is generated from the trial count
+        for path in (self.trials_file, self.square_file):
+            if path is None:
+                continue
+            with open(path, 'rb') as stimulus_file:
+                digest.update(stimulus_file.read())
+
+        return digest.hexdigest()
+
+    def cache_file(self, participant_id):
+        return os.path.join(self.cache_dir, u'plan_{}.json'.format(self.key(participant_id)))
+
+    def compile(self, participant_id):
+        trials = load_sentences(self.trials_file)
+
+        if self.square_file is None:
+            design = load_design(self.trials_file)
+            if design is None:
+                width, blocks = design_shape(len(trials), len(CONDITIONS))
+            else:
+                width, blocks = design['square'], design['blocks']
+            latin_square = cached_square(width, self.cache_dir)
+        else:
+            latin_square = load_square(self.square_file)
+            blocks = -(-len(trials) // latin_square.shape[1])
+        width = latin_square.shape[1]
+        logging.info(u'Counterbalancing {} items over {} blocks of a {}-item Latin square'.format(
+            len(trials), blocks, width
+        ))
+
+        # Sentence numbers index the participant's cells, so every one of
+        # them has to fall inside the blocks read from the square
+        numbers = sentence_numbers(trials)
+        if numbers and (min(numbers) < 1 or max(numbers) > width * blocks):
+            raise ValueError(u'{} blocks of a {}-item Latin square cover sentences 1-{}, but {} numbers them {}-{}'.format(
+                blocks, width, width * blocks, self.trials_file, min(numbers), max(numbers)
+            ))
+        if width % len(CONDITIONS):
+            logging.warning(u'A {}-item Latin square does not hold each of {} conditions equally often'.format(
+                width, len(CONDITIONS)
+            ))
+
+        record = counterbalancing(latin_square, participant_id, blocks)
+        log_counterbalancing(record)
+        conditions = record['conditions']
+
+        plan = []
+        for i in sorted(range(len(numbers)), key=lambda i: numbers[i]):
+            trial = trials[i]
+            trial['condition'] = conditions[numbers[i] - 1]
+            plan.append(prepare_sentence(trial))
+
+        return {'counterbalancing': record, 'trials': plan}
+
+    def load(self, participant_id):
+        cache_file = self.cache_file(participant_id)
+        if os.path.exists(cache_file):
+            with io.open(cache_file, 'r', encoding='utf-8') as plan_file:
+                plan = json.load(plan_file)
+            logging.info(u'Trial plan loaded from {}'.format(cache_file))
+            log_counterbalancing(plan['counterbalancing'])
+            return plan['trials']
+
+        plan = self.compile(participant_id)
+        self.save(plan, cache_file)
+        logging.info(u'Trial plan compiled and saved to {}'.format(cache_file))
+        return plan['trials']
+
+    def save(self, plan, cache_file):
+        if not os.path.isdir(self.cache_dir):
+            os.makedirs(self.cache_dir)
+
+        text = json.dumps(plan, ensure_ascii=False, separators=(',', ':'))
+        if isinstance(text, bytes):
+            text = text.decode('utf-8')
+
+        # Write under a temporary name first so a crashed or concurrent
+        # launch never leaves a half-written plan behind
+        temp_file = u'{}.{}.tmp'.format(cache_file, os.getpid())
+        with io.open(temp_file, 'w', encoding='utf-8') as plan_file:
+            plan_file.write(text)
+        try:
+            os.rename(temp_file, cache_file)
+        except OSError:
+            os.remove(temp_file)
@@ -12,7 +12,9 @@ from datetime import datetime
 import time
 import os, sys
 
-from .srbox import SRBox
+from .trialplan import prepare_sentence
+from .logsink import log, log_on_flip
+from .responses import LEFT, RIGHT
 
 TEXT_GET_READY = u'请准备'
 TEXT_FEEDBACK_CORRECT = u'正确！'
@@ -20,6 +22,11 @@ TEXT_FEEDBACK_INCORRECT = u'错误！'
 
 SPEED_MULTIPLIER = 1.0
 
+TIMED_PHASES = ('blank', 'fixation', 'pair_fixation', 'feedback')
+
+# Share of each fixation frame that may be spent pre-rendering words
+PRERENDER_BUDGET = 0.5
+
 class SentenceBlock():
     def __init__(self, parent, experiment, exp_info, sentence_list, autorun=False):
         logging.debug(u'Entered SentenceBlock()')
@@ -36,27 +43,18 @@ class SentenceBlock():
             logging.exp(u'EXPERIMENT IN AUTORUN MODE DO NOT USE DATA')
 
         self.window = self.parent.window
-        self.use_srbox = self.parent.use_srbox
-        if self.use_srbox:
-            self.srbox = self.parent.srbox
-
-        self.block_clock = core.Clock()
+        self.block_clock = self.parent.new_clock()
 
         self.sentences = data.TrialHandler(
             nReps=1, method='random', extraInfo=self.exp_info,
             originPath=-1, trialList=sentence_list,
             seed=None, name='sentence_block',
-            dataTypes=['block.acc', 'block.RT', 'frame_rate', 'pretrial_fixation']
+            dataTypes=['block.acc', 'block.RT', 'frame_rate', 'pretrial_fixation',
+                       'frames.dropped', 'frames.jitter']
         )
 
         self.experiment.addLoop(self.sentences)
 
-        self.conditions = {
-            1: 'both_sim',
-            2: 'orth_sim',
-            3: 'phon_sim',
-            4: 'both_dif'
-        }
         self.begin_block()
         logging.flush()
 
@@ -66,74 +64,72 @@ class SentenceBlock():
         self.parent.display_message(TEXT_GET_READY, time=3*SPEED_MULTIPLIER)
         for sentence in self.sentences:
             sentence = self.prepare_trial(sentence)
-            block_frame_rate = self.window.getActualFrameRate()
+            # Only measure the refresh rate again if the running estimate has
+            # moved; the screen is blank here between sentences
+            if self.parent.frame_monitor.drifted():
+                self.parent.recalibrate_frame_rate()
+            block_frame_rate = self.parent.frame_monitor.rate
             sentence_trial = SentenceTrial(
                 self.parent, self.experiment, self.exp_info,
                 sentence['target_sentence'], sentence['alt_sentence'],
-                self.autorun
+                sentence['critical_pair'], self.autorun
             )
+            self.parent.frame_timer.reset()
             sentence_acc, sentence_time, fixation_length = sentence_trial.begin_trial()
-            logging.flush()
+            timing = self.parent.frame_timer.end_trial()
 
             self.sentences.addData('frame_rate', block_frame_rate)
             self.sentences.addData('block.acc', sentence_acc)
             self.sentences.addData('block.RT', '{:.2f}'.format(sentence_time * 1000))
             self.sentences.addData('pretrial_fixation', '{:.2f}'.format(fixation_length * 1000))
-            self.parent.experiment.nextEntry()
+            self.add_timing_data(timing)
+            self.parent.next_entry()
+            self.parent.data_stream.sync()
+            # Between sentences is the only place the log is handed to disk
+            self.parent.flush_logs()
 
         self.experiment.loopEnded(self.sentences)
 
+    def add_timing_data(self, timing):
+        self.sentences.addData('frames.dropped', timing['dropped'])
+        self.sentences.addData('frames.jitter', '{:.2f}'.format(timing['jitter'] * 1000))
+        for phase in TIMED_PHASES:
+            stats = timing['phases'].get(phase)
+            if stats is None:
+                continue
+            self.sentences.addData('{}.dropped'.format(phase), stats['dropped'])
+            self.sentences.addData('{}.intended'.format(phase), '{:.2f}'.format(stats['intended'] * 1000))
+            self.sentences.addData('{}.actual'.format(phase), '{:.2f}'.format(stats['actual'] * 1000))
 
     def prepare_trial(self, trial):
         logging.debug(u'Preparing trial for sentence {}, critical target {}'.format(
             trial['sentence_number'], trial['critical_target']
         ))
 
-        trial['critical_distractor'] = trial['distractors'][self.conditions[trial['condition']]]
+        # Trials from a compiled plan already carry their sentence strings
+        if 'target_sentence' not in trial:
+            trial = prepare_sentence(trial)
 
         logging.exp(u'Set critical distractor to: {}'.format(trial['critical_distractor']))
-        trial['target_sentence'], trial['alt_sentence'], trial['critical_index'] = self.process_sentence(trial['sentence'], trial['critical_distractor'])
-
-        del trial['sentence']
-        del trial['distractors']
-        if 'original_distractors' in trial:
-            del trial['original_distractors']
 
         if self.autorun:
             trial['AUTORUN_DATA'] = u'EXPERIMENT IN AUTORUN MODE DO NOT USE DATA'
 
         return trial
 
-    def process_sentence(self, sentence_pairs, distractor):
-        target = []
-        alternative = []
-        critical_index = 0
-        count = 0
-        for pair in sentence_pairs:
-            if u'＃' in pair[1]:
-                target.append(pair[0])
-                alternative.append(distractor)
-                critical_index = count
-            elif pair[1] == u'*':
-                    target[-1] = u'{}{}'.format(target[-1], pair[0])
-                    alternative[-1] = u'{}{}'.format(alternative[-1], pair[0])
-            else:
-                target.append(pair[0])
-                alternative.append(pair[1])
-
-            count += 1
-
-        return u' | '.join(target), u' | '.join(alternative), critical_index
-
 class SentenceTrial():
-    def __init__(self, parent, experiment, exp_info, target_sentence, alternative_sentence, autorun=False):
+    def __init__(self, parent, experiment, exp_info, target_sentence, alternative_sentence,
+                 critical_pair, autorun=False):
         self.exp_info = exp_info
+        self.critical_pair = critical_pair
         zipped_sentence = zip(target_sentence.split(' | '), alternative_sentence.split(' | '))
         self.sentence = []
-        for pair in zipped_sentence:
+        for position, pair in enumerate(zipped_sentence):
             self.sentence.append({
                 'pair_correct': pair[0],
-                'pair_distractor': pair[1]
+                'pair_distractor': pair[1],
+                # Word position relative to the critical word, which is 0
+                'critical_offset': position - critical_pair
             })
 
         self.experiment = experiment
@@ -149,13 +145,10 @@ class SentenceTrial():
         self.text_left = self.parent.text_left
         self.text_right = self.parent.text_right
         self.acc_feedback = self.parent.acc_feedback
+        self.pair_cache = self.parent.pair_cache
 
-        self.use_srbox = self.parent.use_srbox
-        if self.use_srbox:
-            self.srbox = self.parent.srbox
-
-        self.trial_clock = core.Clock()
-        self.pair_clock = core.Clock()
+        self.trial_clock = self.parent.new_clock()
+        self.pair_clock = self.parent.new_clock()
 
         self.trial = data.TrialHandler(
             nReps=1, method='sequential', extraInfo=self.exp_info,
@@ -178,12 +171,15 @@ class SentenceTrial():
         self.text_left.text = ''
         self.text_right.text = ''
 
-        logging.info(u'{}: Reset text'.format(self.text_left.name))
-        logging.info(u'{}: Reset text'.format(self.text_right.name))
+        log(logging.INFO, u'{}: Reset text', self.text_left.name)
+        log(logging.INFO, u'{}: Reset text', self.text_right.name)
 
         self.show_blank(.5*SPEED_MULTIPLIER)
         fixation_length = (1 + 1*random()) * SPEED_MULTIPLIER
+        # Every word of the sentence is rendered while the fixation cross is up
+        self.pair_cache.queue_pairs(self.sentence)
         self.show_fixation(fixation_length)
+        self.pair_cache.finish()
 
         sentence_correct = True
 
@@ -192,11 +188,12 @@ class SentenceTrial():
         logging.exp(u'trial_clock: Reset time')
         self.trial_clock.reset()
         for pair in self.trial:
-            self.show_fixation(0.2*SPEED_MULTIPLIER)
+            self.show_fixation(0.2*SPEED_MULTIPLIER, 'pair_fixation')
 
             target_pos = self.show_pair(pair)
+            onset = self.parent.scheduler.last_onset
 
-            logging.exp(u'pair_clock: Reset time')
+            log(logging.EXP, u'pair_clock: Reset time')
             self.pair_clock.reset()
 
             acc, response_time, response = self.get_response(target_pos)
@@ -217,6 +214,10 @@ class SentenceTrial():
             self.trial.addData('resp.RT', '{:.2f}'.format(response_time * 1000))
             self.trial.addData('resp.acc', acc)
 
+            self.trial.addData('pair.onset_scheduled', '{:.4f}'.format(onset['scheduled']))
+            self.trial.addData('pair.onset_actual', '{:.4f}'.format(onset['actual']))
+            self.trial.addData('pair.onset_slip', onset['slip'])
+
             self.trial.addData('prev.pos', prev_pos)
             self.trial.addData('prev.resp', prev_resp)
 
@@ -226,7 +227,7 @@ class SentenceTrial():
             prev_pos = target_pos
             prev_resp = response
 
-            self.parent.experiment.nextEntry()
+            self.parent.next_entry()
 
             if acc == 0:
                 logging.exp(u'Incorrect sentence path chosen')
@@ -238,39 +239,36 @@ class SentenceTrial():
         self.experiment.loopEnded(self.trial)
 
         if sentence_correct:
-            logging.info(u'Sentence completed accurately.')
-            logging.data(u'Block completion time: {}'.format(block_time))
-            logging.data(u'Block accuracy: {}'.format(1))
+            log(logging.INFO, u'Sentence completed accurately.')
+            log(logging.DATA, u'Block completion time: {}', block_time)
+            log(logging.DATA, u'Block accuracy: {}', 1)
             return 1, block_time, fixation_length
         else:
-            logging.info(u'Sentence was not completed accurately.')
-            logging.data(u'Block completion time: {}'.format(block_time))
-            logging.data(u'Block accuracy: {}'.format(0))
+            log(logging.INFO, u'Sentence was not completed accurately.')
+            log(logging.DATA, u'Block completion time: {}', block_time)
+            log(logging.DATA, u'Block accuracy: {}', 0)
             return 0, block_time, fixation_length
 
     def show_pair(self, pair):
         target_pos = randint(0,2)
-        logging.exp(u'Pair target position: {}'.format(target_pos))
+        log(logging.EXP, u'Pair target position: {}', target_pos)
         if target_pos == 0:
-            self.text_left.text = u'' + pair['pair_correct']
-            # self.text_left.color = (-1, -0.50, -1)
-            self.text_right.text = u'' + pair['pair_distractor']
-            # self.text_right.color = (-1, -1, -1)
+            text_left = self.pair_cache.get(LEFT, pair['pair_correct'])
+            text_right = self.pair_cache.get(RIGHT, pair['pair_distractor'])
         else:
-            self.text_left.text = u'' + pair['pair_distractor']
-            # self.text_left.color = (-1, -1, -1)
-            self.text_right.text = u'' + pair['pair_correct']
-            # self.text_right.color = (-1, -0.50, -1)
+            text_left = self.pair_cache.get(LEFT, pair['pair_distractor'])
+            text_right = self.pair_cache.get(RIGHT, pair['pair_correct'])
 
-        logging.info(u'{}: Set text to "{}"'.format(self.text_left.name, self.text_left.text))
-        logging.info(u'{}: Set text to "{}"'.format(self.text_right.name, self.text_right.text))
+        log(logging.INFO, u'{}: Set text to "{}"', text_left.name, text_left.text)
+        log(logging.INFO, u'{}: Set text to "{}"', text_right.name, text_right.text)
 
-        self.text_left.draw()
-        self.text_right.draw()
+        text_left.draw()
+        text_right.draw()
 
-        self.window.logOnFlip(u'{}: Display text "{}"'.format(self.text_left.name, self.text_left.text), logging.EXP)
-        self.window.logOnFlip(u'{}: Display text "{}"'.format(self.text_right.name, self.text_right.text), logging.EXP)
-        self.flip()
+        log_on_flip(self.window, logging.EXP, u'{}: Display text "{}"', text_left.name, text_left.text)
+        log_on_flip(self.window, logging.EXP, u'{}: Display text "{}"', text_right.name, text_right.text)
+        # The pair replaces the fixation cross on the frame it was scheduled for
+        self.parent.scheduler.present('pair', 1, timed=False)
 
         return target_pos
 
@@ -282,104 +280,66 @@ class SentenceTrial():
             self.acc_feedback.text = TEXT_FEEDBACK_CORRECT
             self.acc_feedback.color = (-1, 1, -1)
 
-        logging.info(u'{}: Set feedback to "{}"'.format(self.acc_feedback.name, self.acc_feedback.text))
-        self.window.logOnFlip(u'{}: Display feedback "{}"'.format(self.acc_feedback.name, self.acc_feedback.text), logging.EXP)
+        log(logging.INFO, u'{}: Set feedback to "{}"', self.acc_feedback.name, self.acc_feedback.text)
+        log_on_flip(self.window, logging.EXP, u'{}: Display feedback "{}"', self.acc_feedback.name, self.acc_feedback.text)
 
-        for i in range(1+int(89*SPEED_MULTIPLIER)):
-            self.acc_feedback.draw()
-            self.flip()
+        frames = 1+int(89*SPEED_MULTIPLIER)
+        self.parent.scheduler.present('feedback', frames, draw=self.acc_feedback.draw)
 
-        self.window.logOnFlip(u'{}: Hide feedback "{}"'.format(self.acc_feedback.name, self.acc_feedback.text), logging.EXP)
+        log_on_flip(self.window, logging.EXP, u'{}: Hide feedback "{}"', self.acc_feedback.name, self.acc_feedback.text)
 
     def clear_pair(self):
-        self.text_left.text = ''
-        self.text_right.text = ''
-
-        logging.info(u'{}: Reset text'.format(self.text_left.name))
-        logging.info(u'{}: Reset text'.format(self.text_right.name))
-
-        self.text_left.color = (-1, -1, -1)
-        self.text_right.color = (-1, -1, -1)
+        # The pair was drawn from the cache, so the shared stimuli are still
+        # blank and only need a flip without the words
+        log(logging.INFO, u'{}: Reset text', self.text_left.name)
+        log(logging.INFO, u'{}: Reset text', self.text_right.name)
 
-        self.text_left.draw()
-        self.text_right.draw()
-
-        self.window.logOnFlip(u'{}: Display text "{}"'.format(self.text_left.name, self.text_left.text), logging.EXP)
-        self.window.logOnFlip(u'{}: Display text "{}"'.format(self.text_right.name, self.text_right.text), logging.EXP)
-        self.flip()
+        log_on_flip(self.window, logging.EXP, u'{}: Display text "{}"', self.text_left.name, self.text_left.text)
+        log_on_flip(self.window, logging.EXP, u'{}: Display text "{}"', self.text_right.name, self.text_right.text)
+        self.parent.scheduler.present('clear', 1, timed=False)
 
     def get_response(self, target_pos):
-        logging.exp(u'Waiting for response...')
+        log(logging.EXP, u'Waiting for response...')
 
-        if self.autorun:
-            logging.exp(u'Autorun active. Sending automatic response...')
-            auto_response_time = 0.5 + random()
-            if randint(0,100) < 98:
-                return 1, auto_response_time, target_pos
-            else:
-                return 0, auto_response_time, int(not target_pos)
+        response = self.parent.response_device.wait_response(self.pair_clock, target_pos)
+        self.parent.scheduler.resync()
+        log(logging.EXP, u'Key presses received')
 
-        if self.use_srbox:
-            response, response_time = self.srbox.waitKeys(keyList=[1, 5], timeStamped=self.pair_clock)
-            response = response[0]
-        else:
-            response, response_time = event.waitKeys(keyList=['c', 'm'], timeStamped=self.pair_clock)[0]
-        logging.exp(u'Key presses received')
-        # response_time = self.pair_clock.getTime()
-
-        if response in ('c', 1):
-            response = 0
-        elif response in ('m', 5):
-            response = 1
-
-        logging.exp(u'Kepress position: {}'.format(response))
-
-        if response == target_pos:
-            logging.info(u'Kepress does match target position.')
-            logging.data(u'Response: {}'.format(response))
-            logging.data(u'Acc: {}'.format(1))
-            logging.data(u'Response time: {}'.format(response_time))
-            return 1, response_time, response
+        log(logging.EXP, u'Kepress position: {}', response.side)
+
+        if response.side == target_pos:
+            log(logging.INFO, u'Kepress does match target position.')
+            log(logging.DATA, u'Response: {}', response.side)
+            log(logging.DATA, u'Acc: {}', 1)
+            log(logging.DATA, u'Response time: {}', response.rt)
+            return 1, response.rt, response.side
         else:
-            logging.info(u'Kepress does match target position.')
-            logging.data(u'Response: {}'.format(response))
-            logging.data(u'Acc: {}'.format(0))
-            logging.data(u'Response time: {}'.format(response_time))
-            return 0, response_time, response
-
-    def show_fixation(self, time):
-        frames = int(round(time / self.parent.frame_dur))
-        self.window.logOnFlip(
-            'Begin show fixation for {:.2f} ({} frames/{} actual est.)'.format(time, frames, (frames*self.parent.frame_dur)),
-            logging.EXP
+            log(logging.INFO, u'Kepress does match target position.')
+            log(logging.DATA, u'Response: {}', response.side)
+            log(logging.DATA, u'Acc: {}', 0)
+            log(logging.DATA, u'Response time: {}', response.rt)
+            return 0, response.rt, response.side
+
+    def show_fixation(self, time, phase='fixation'):
+        frames = self.parent.scheduler.frames(time)
+        log_on_flip(
+            self.window, logging.EXP,
+            'Begin show fixation for {:.2f} ({} frames/{} actual est.)', time, frames, (frames*self.parent.frame_dur)
         )
-        for i in range(frames):
-            self.parent.fixation.draw()
-            self.flip()
+        self.parent.scheduler.present(phase, frames, draw=self.draw_fixation)
 
         self.window.logOnFlip(u'End show fixation', logging.EXP)
 
+    def draw_fixation(self):
+        self.pair_cache.step(PRERENDER_BUDGET*self.parent.frame_dur)
+        self.parent.fixation.draw()
+
     def show_blank(self, time):
-        frames = int(round(time / self.parent.frame_dur))
-        self.window.logOnFlip(
-            'Begin show blank screen for {:.2f} ({} frames/{} actual est.)'.format(time, frames, (frames*self.parent.frame_dur)),
-            logging.EXP
+        frames = self.parent.scheduler.frames(time)
+        log_on_flip(
+            self.window, logging.EXP,
+            'Begin show blank screen for {:.2f} ({} frames/{} actual est.)', time, frames, (frames*self.parent.frame_dur)
         )
-        for i in range(frames):
-            self.flip()
+        self.parent.scheduler.present('blank', frames)
 
         self.window.logOnFlip(u'End show blank screen', logging.EXP)
-
-    def flip(self):
-        self.check_abort()
-        self.window.flip()
-
-    def check_abort(self):
-        keys = event.getKeys(keyList=['escape'], modifiers=True)
-        if keys and (keys[0][0] == 'escape' and keys[0][1]['ctrl'] and keys[0][1]['alt']):
-            self.experiment.saveAsWideText('{}.csv'.format(self.parent.data_file_stem))
-            logging.flush()
-            # make sure everything is closed down
-            self.experiment.abort()
-            self.window.close()
-            core.quit()
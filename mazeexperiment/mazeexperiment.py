@@ -34,11 +34,33 @@ __author__ = "Nick Anderegg"
 #COPYRIGHT="(C) 2016 Your Name"
 
 import experiment
+from experiment import simulation
+from psychopy import logging
+import argparse
 import os, sys
 
 def main():
     exp_pwd = os.path.dirname(os.path.abspath(__file__)).decode(sys.getfilesystemencoding())
     experiment.Experiment(exp_name="RPACR", use_srbox=True, pwd=exp_pwd, autorun=False)
 
+def simulate():
+    parser = argparse.ArgumentParser(description='Run simulated participants headlessly in parallel.')
+    parser.add_argument('participants', type=int, help='number of participants to simulate')
+    parser.add_argument('output', help='directory for the per-participant and merged data')
+    parser.add_argument('--first-participant', type=int, default=1)
+    parser.add_argument('--seed', type=int, default=0, help='base seed; participant N uses seed + N')
+    parser.add_argument('--processes', type=int, default=None)
+    args = parser.parse_args()
+
+    # Progress of the pool is logged; show it on the console
+    logging.console.setLevel(logging.INFO)
+
+    exp_pwd = os.path.dirname(os.path.abspath(__file__)).decode(sys.getfilesystemencoding())
+    merged = simulation.simulate_participants(
+        args.participants, os.path.abspath(args.output), exp_pwd, exp_name="RPACR",
+        first_participant=args.first_participant, base_seed=args.seed, processes=args.processes
+    )
+    print('Merged data written to {}'.format(merged))
+
 if __name__ == "__main__":
     main()
@@ -29,7 +29,8 @@ setup(
     #add required packages to install_requires list
     #install_requires=["package","package2"]
     entry_points = {
-        "console_scripts": ['%s = %s.%s:main' % (projectName,projectName,projectName)]
+        "console_scripts": ['%s = %s.%s:main' % (projectName,projectName,projectName),
+                            '%s-simulate = %s.%s:simulate' % (projectName,projectName,projectName)]
         },
     version = version,
     description = description,